@@ -3,6 +3,9 @@ import pandas as pd
 import matplotlib.pyplot as plt 
 from pairs_trading import find_cointegrated_pairs, compute_spread, generate_pairs_trading_signals
 from portfolio import Portfolio
+from pricecube import has_ticker, get_series, get_field_frame
+from signals import ma_crossover_stats
+from sweep import sweep_moving_average, sweep_pairs_trading, scan_cointegrated_pairs
 
 
 class BackTester:
@@ -20,13 +23,13 @@ class BackTester:
             
         for t1, t2 in pairs:
         # Tjek at begge tickers findes i data
-            if t1 not in self.portfolio.data.columns.get_level_values(0) or t2 not in self.portfolio.data.columns.get_level_values(0):
+            if not has_ticker(self.portfolio.data, t1) or not has_ticker(self.portfolio.data, t2):
                 print(f"Skipping pair {t1}-{t2}: Ticker not found in data")
                 continue
         
             results = {}  # dict til tradesignal og afkast for hvert par
-            s1 = self.portfolio.data[(t1, 'Close')].dropna()
-            s2 = self.portfolio.data[(t2, 'Close')].dropna()
+            s1 = get_series(self.portfolio.data, t1).dropna()
+            s2 = get_series(self.portfolio.data, t2).dropna()
             
             #please samme index
             common_idx = s1.index.intersection(s2.index)
@@ -48,12 +51,18 @@ class BackTester:
             results[(t1, t2)] = tradesignal
         return results  # Dictionary: (t1, t2) -> tradesignal DataFrame
         
-    def moving_average_strat(self, ticker, window: int = 30, start_date=None, end_date = None):
-        """Backtests a MA-strategy on a given ticker in your portfolio"""
-        if ticker not in self.portfolio.data.columns.get_level_values(0):
+    def moving_average_strat(self, ticker, window: int = 30, start_date=None, end_date = None, vectorized=True):
+        """Backtests a MA-strategy on a given ticker in your portfolio
+
+        Args:
+            vectorized (bool, optional): If True, the fills are found from the signal changes with array math and
+                written to the portfolio in one execute_orders batch. If False, every row is simulated with buy_max/sell_all.
+                Both give the same trades. Defaults to True.
+        """
+        if not has_ticker(self.portfolio.data, ticker):
             raise ValueError(f'Ticker {ticker} was not found in portfolio data')
         
-        data_series = self.portfolio.data[(ticker, 'Close')].loc[start_date:end_date]        
+        data_series = get_series(self.portfolio.data, ticker).loc[start_date:end_date]        
         ma = data_series.rolling(window).mean()
         
         tradesignal = pd.DataFrame(index=data_series.index)
@@ -69,6 +78,10 @@ class BackTester:
         
         tradesignal['positions_change'] = tradesignal['signal'].diff() #Kigger efter hvornår der sker en ændring
         
+        if vectorized:
+            self._execute_signal_changes(ticker, tradesignal['price'].to_numpy(dtype=float),
+                                         tradesignal['positions_change'].to_numpy(), tradesignal.index)
+            return tradesignal
 
         #simulere trades
         for idx, row in tradesignal.iterrows():
@@ -77,13 +90,81 @@ class BackTester:
             elif row['positions_change'] == -2: #skift fra 1 til -1 (salg)
                 self.sell_all(ticker,idx)
         return tradesignal
+
+    def _execute_signal_changes(self, ticker, prices: np.ndarray, positions_change: np.ndarray, dates: pd.DatetimeIndex):
+        """
+        Vectorized counterpart of the buy_max/sell_all loop: only the bars where the signal flips are visited,
+        the all-in share counts and the cash path are computed with scalar math, and the fills go to the portfolio
+        as one execute_orders batch.
+        """
+        events = np.flatnonzero(np.abs(positions_change) == 2)
+        cash = self.portfolio.current_cash
+        shares = self.portfolio.get_asset_quantity(ticker)
+        orders = []
+        for i in events: #en iteration pr. handel, ikke pr. dag. Hver handel afhænger af kontanterne efter den forrige
+            price = prices[i]
+            if positions_change[i] > 0:
+                quantity = int(cash / price)
+                if quantity > 0 and not price * quantity > cash: #samme tjek som buy_max og buy_asset
+                    orders.append({'ticker': ticker, 'quantity': quantity, 'side': 'buy', 'date': dates[i]})
+                    cash -= price * quantity
+                    shares += quantity
+            elif shares > 0:
+                orders.append({'ticker': ticker, 'quantity': shares, 'side': 'sell', 'date': dates[i]})
+                cash += price * shares
+                shares = 0
+        if orders:
+            self.portfolio.execute_orders(orders)
                     
+    def moving_average_screen(self, window: int = 30, tickers=None, start_date=None, end_date=None) -> pd.DataFrame:
+        """
+        Runs the MA-strategy of moving_average_strat on every ticker at once, on the dates x tickers close matrix.
+        Each ticker is traded all-in on its own: buy when the price crosses above its moving average, sell when it
+        crosses below, and an open position is valued at the last price.
+
+        Args:
+            window (int, optional): Moving average window. Defaults to 30.
+            tickers (list, optional): Tickers to screen. Defaults to every ticker in the data.
+            start_date, end_date (str, optional): Date range of the backtest.
+
+        Returns:
+            pd.DataFrame: One row per ticker with Total Return, Buy-and-Hold Return, Outperformance, Trades
+                (buys and sells, like strategy_summary), Round Trips and Win Rate (share of round trips sold above the buy price).
+                Returns are fractions, sorted by Total Return.
+        """
+        close = get_field_frame(self.portfolio.data, 'Close')
+        if tickers is not None:
+            close = close[list(tickers)]
+        close = close.loc[start_date:end_date]
+        if len(close) <= window:
+            raise ValueError(f"Need more than {window} dates to screen a {window} day moving average.")
+        stats = ma_crossover_stats(close.to_numpy(dtype=float), close.rolling(window).mean().to_numpy(), window)
+        results = pd.DataFrame(stats, index=pd.Index(close.columns, name='Ticker'))
+        return results.sort_values('Total Return', ascending=False)
+
+    def sweep_moving_average(self, windows, tickers=None, start_date=None, end_date=None, processes=None, stream=False):
+        """Tests many MA windows on many tickers in a process pool, see sweep.sweep_moving_average"""
+        return sweep_moving_average(self.portfolio.data, windows, tickers=tickers, start_date=start_date,
+                                    end_date=end_date, processes=processes, stream=stream)
+
+    def sweep_pairs_trading(self, pairs, zscore_windows=(30,), z_entries=(2.3,), z_exits=(0.5,), processes=None, stream=False):
+        """Tests a grid of zscore_window, z_entry and z_exit on many pairs in a process pool, see sweep.sweep_pairs_trading"""
+        return sweep_pairs_trading(self.portfolio.data, pairs, zscore_windows=zscore_windows, z_entries=z_entries,
+                                   z_exits=z_exits, processes=processes, stream=stream)
+
+    def scan_cointegrated_pairs(self, tickers=None, significance=0.05, processes=None, top_k=None, cancel=None, stream=False, prescreen=None,
+                                cache=None):
+        """Finds cointegrated pairs in a process pool, see sweep.scan_cointegrated_pairs"""
+        return scan_cointegrated_pairs(self.portfolio.data, tickers=tickers, significance=significance, processes=processes,
+                                       top_k=top_k, cancel=cancel, stream=stream, prescreen=prescreen, metadata=self.portfolio.metadata,
+                                       cache=cache)
+
     def sell_in_may_and_go_away_strategy(self, ticker, start_date = None, end_date=None):
         """Backtests the questionable strategy of selling in may, and then going away. A strategy my grandfather swears by"""
-        if ticker not in self.portfolio.data.columns.get_level_values(0):
+        if not has_ticker(self.portfolio.data, ticker):
             raise ValueError(f'Ticker {ticker} was not found in portfolio data')
         
-        data_series = self.portfolio.data[(ticker, 'Close')].loc[start_date:end_date]
+        data_series = get_series(self.portfolio.data, ticker).loc[start_date:end_date]
         
 
         tradesignal = pd.DataFrame(index=data_series.index)
@@ -112,16 +193,16 @@ class BackTester:
         if initial_cash is None:
             initial_cash = self.portfolio.starting_cash
         
-        log_df = self.portfolio.get_portfolio_log()
-        ticker_log = log_df[log_df['Ticker'] == ticker]
+        ticker_log = self.portfolio.log.for_ticker(ticker)
         
         # beregn strategy performance
         final_value = self.portfolio.get_portfolio_value()
         total_return = (final_value - initial_cash) / initial_cash * 100
         
         # Buy-and-hold sammenligning
-        start_price = self.portfolio.data[ticker]['Close'].iloc[0]
-        end_price = self.portfolio.data[ticker]['Close'].iloc[-1]
+        close_series = get_series(self.portfolio.data, ticker)
+        start_price = close_series.iloc[0]
+        end_price = close_series.iloc[-1]
         bh_return = (end_price - start_price) / start_price * 100
         
         # Trading metrics
@@ -156,7 +237,7 @@ class BackTester:
         cumulative_strategy = (1 + strategy_returns).cumprod()  #kumuleret afkast fra strategien
         
         
-        bh_prices = self.portfolio.data[ticker]['Close'].loc[signals.index]
+        bh_prices = get_series(self.portfolio.data, ticker).loc[signals.index]
         bh_returns = bh_prices.pct_change()
         cumulative_bh = (1 + bh_returns).cumprod()  # Kumuleret buy-and-hold
         
@@ -171,9 +252,9 @@ class BackTester:
         plt.grid(True)
         plt.show()
         
-    def moving_average_strategy_full(self, ticker, window:int):
+    def moving_average_strategy_full(self, ticker, window:int, vectorized=True):
         """one-click analysis wrapper function"""
-        signals = self.moving_average_strat(ticker, window)
+        signals = self.moving_average_strat(ticker, window, vectorized=vectorized)
         self.strategy_summary(ticker, self.portfolio.starting_cash)
         self.generate_performance_report(signals, ticker)
         return signals
@@ -210,8 +291,8 @@ class BackTester:
                 cumulative_return = tradesignal['cumulative_returns'].iloc[-1]
             
             # Buy-and-hold benchmark for dette pair
-            s1 = self.portfolio.data[(t1, 'Close')].loc[tradesignal.index]
-            s2 = self.portfolio.data[(t2, 'Close')].loc[tradesignal.index]
+            s1 = get_series(self.portfolio.data, t1).loc[tradesignal.index]
+            s2 = get_series(self.portfolio.data, t2).loc[tradesignal.index]
             bh_return_1 = (s1.iloc[-1] / s1.iloc[0]) - 1
             bh_return_2 = (s2.iloc[-1] / s2.iloc[0]) - 1
             bh_return_avg = (bh_return_1 + bh_return_2) / 2
@@ -237,14 +318,18 @@ class BackTester:
             print("\nNo valid pair returns.")
             print("="*50)
 
-    def pairs_trading_strategy_full(self, tickers: list, significance=0.05, max_pairs = 5):
-        """One-click analysis wrapper function for pairs trading"""
+    def pairs_trading_strategy_full(self, tickers: list, significance=0.05, max_pairs = 5, processes=1, prescreen=None, cache=None):
+        """One-click analysis wrapper function for pairs trading. processes > 1 (or None for all cores) scans the pairs in a process pool,
+        and prescreen filters the candidate pairs first, see cointegration.prescreen_pairs.
+        With a cointcache.CointegrationCache (in both modes) pairs are read from the cache unless a price was revised
+        or the entry is more than its max_new_bars (default 5) bars old, so a daily rerun only retests a fraction of the pairs"""
         #find cointegratede par
-        if len(tickers) > 80:
-            raise ValueError("Dont. 80 tickers is reasonable maximum due to time complexity")
-        
-        data_filtered = self.portfolio.data.loc[:, pd.IndexSlice[tickers, 'Close']]
-        pairs = find_cointegrated_pairs(data_filtered, tickers, significance=significance)
+        if processes == 1:
+            pairs = find_cointegrated_pairs(self.portfolio.data, tickers, significance=significance, prescreen=prescreen,
+                                            metadata=self.portfolio.metadata, cache=cache)
+        else:
+            pairs = scan_cointegrated_pairs(self.portfolio.data, tickers, significance=significance, processes=processes,
+                                            prescreen=prescreen, metadata=self.portfolio.metadata, cache=cache)
         
         best_pairs = [(t1, t2) for t1, t2, pvalue in pairs[:max_pairs]]
         
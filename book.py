@@ -0,0 +1,241 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from pricecube import get_tickers, has_ticker, get_prices_at, get_field_frame
+from tradingcalendar import TradingCalendar
+from txlog import TransactionLog
+from metadata import metadata_from_frame, map_sectors
+
+
+class PortfolioBook:
+    """
+    Many accounts over one shared price source.
+    Holdings are one sparse accounts x tickers matrix and cash is one vector, so valuing every account on a date
+    is a single sparse matrix-vector product, and a NAV history is a single sparse x dense product.
+    Each account keeps its own TransactionLog. Prices of held positions are forward filled,
+    so an account is always valued at the last known close.
+    """
+    def __init__(self, data, accounts=(), starting_cash=100000, metadata=None):
+        self.data = data
+        self.calendar = TradingCalendar(data.index)
+        self.metadata = metadata if metadata is not None else metadata_from_frame(data)
+        self.tickers = pd.Index(get_tickers(data), name='Ticker')
+        self.ticker_map = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.accounts = []
+        self.account_map = {}
+        self.starting_cash = np.empty(0)
+        self.cash = np.empty(0)
+        self.holdings = sparse.csr_matrix((0, len(self.tickers)))
+        self.logs = []
+        self._close = None
+        for account in accounts:
+            self.add_account(account, starting_cash)
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def __repr__(self):
+        return f"PortfolioBook(accounts={len(self.accounts)}, positions={self.holdings.nnz}, cash={self.cash.sum():.2f})"
+
+    @classmethod
+    def from_portfolios(cls, portfolios, metadata=None):
+        """
+        Builds a book from Portfolio objects that share the same price data.
+        Holdings and cash are taken over as they are now, the logs are copy-on-write forks of the portfolio logs.
+        """
+        portfolios = list(portfolios)
+        if not portfolios:
+            raise ValueError("No portfolios given.")
+        data = portfolios[0].data
+        if any(portfolio.data is not data for portfolio in portfolios):
+            raise ValueError("All portfolios must share the same price data.")
+        book = cls(data, metadata=metadata if metadata is not None else portfolios[0].metadata)
+        rows, cols, quantities = [], [], []
+        for row, portfolio in enumerate(portfolios):
+            book._add_row(portfolio.name, portfolio.starting_cash, portfolio.current_cash, portfolio.log.fork())
+            for ticker, quantity in portfolio.assets.items():
+                rows.append(row)
+                cols.append(book.ticker_map[ticker])
+                quantities.append(quantity)
+        book.holdings = sparse.csr_matrix((quantities, (rows, cols)), shape=(len(portfolios), len(book.tickers)))
+        return book
+
+    def _add_row(self, account, starting_cash, cash, log):
+        if account in self.account_map:
+            raise ValueError(f"Account {account} already exists.")
+        self.account_map[account] = len(self.accounts)
+        self.accounts.append(account)
+        self.starting_cash = np.append(self.starting_cash, float(starting_cash))
+        self.cash = np.append(self.cash, float(cash))
+        self.logs.append(log)
+
+    def add_account(self, account, starting_cash=100000):
+        """Adds an empty account with starting_cash in cash."""
+        self._add_row(account, starting_cash, starting_cash, TransactionLog())
+        self.holdings = sparse.vstack([self.holdings, sparse.csr_matrix((1, len(self.tickers)))], format='csr')
+
+    def log(self, account) -> TransactionLog:
+        return self.logs[self.account_map[account]]
+
+    def account_holdings(self, account) -> pd.Series:
+        """Shares held by one account, indexed by ticker."""
+        row = self.holdings.getrow(self.account_map[account])
+        return pd.Series(row.data, index=self.tickers[row.indices], name=account, dtype=float)
+
+    def _close_prices(self) -> np.ndarray:
+        """Forward filled dates x tickers close matrix, built on first use."""
+        if self._close is None:
+            close = get_field_frame(self.data, 'Close').reindex(columns=self.tickers)
+            self._close = close.ffill().to_numpy(dtype=float)
+        return self._close
+
+    def _value_position(self, at_date) -> int:
+        return len(self.calendar) - 1 if at_date is None else self.calendar.previous_position(at_date)
+
+    def execute_trades(self, trades) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Applies many trades across accounts in one pass, with the same rules as Portfolio.execute_orders.
+        Dates and prices are resolved with one vectorized lookup, cash and holdings are checked per account
+        in the order given, and all fills are added to the holdings matrix as one sparse update.
+
+        Args:
+            trades (pd.DataFrame or list of dicts): One row per trade with columns account, ticker, quantity,
+                side ('buy' or 'sell'), and optionally date (None = last date in data) and open (True = open price).
+
+        Returns:
+            tuple: (fills, rejections) DataFrames like Portfolio.execute_orders, with an account column.
+        """
+        trades = pd.DataFrame(trades)
+        n = len(trades)
+        accounts = trades['account'].tolist() if n else []
+        tickers = trades['ticker'].tolist() if n else []
+        quantities = trades['quantity'].to_numpy(dtype=float) if n else np.empty(0)
+        sides = trades['side'].str.lower().tolist() if n else []
+        opens = trades['open'].fillna(False).astype(bool).tolist() if 'open' in trades else [False] * n
+
+        positions = np.full(n, len(self.calendar) - 1, dtype=np.int64)
+        if 'date' in trades and n:
+            dates = pd.to_datetime(trades['date'])
+            given = dates.notna().to_numpy()
+            positions[given] = self.calendar.index.searchsorted(pd.DatetimeIndex(dates[given]), side='left')
+        valid_date = positions < len(self.calendar)
+
+        fields = ['Open' if o else 'Close' for o in opens]
+        prices = np.full(n, np.nan)
+        prices[valid_date] = get_prices_at(self.data, positions[valid_date],
+                                           [t for t, ok in zip(tickers, valid_date) if ok],
+                                           [f for f, ok in zip(fields, valid_date) if ok])
+        known = {(t, f): has_ticker(self.data, t, f) for t, f in set(zip(tickers, fields))}
+
+        # Nuværende beholdninger for alle (konto, ticker) par i et opslag
+        rows = np.array([self.account_map.get(a, -1) for a in accounts], dtype=np.int64)
+        cols = np.array([self.ticker_map.get(t, -1) for t in tickers], dtype=np.int64)
+        valid_pair = (rows >= 0) & (cols >= 0)
+        held = np.zeros(n)
+        if valid_pair.any():
+            held[valid_pair] = np.asarray(self.holdings[rows[valid_pair], cols[valid_pair]]).ravel()
+
+        cash = self.cash.copy()
+        changes = {} #(række, kolonne) -> ændring i antal
+        fill_rows, rejections = [], []
+        for i in range(n):
+            row, col, quantity, side, price = rows[i], cols[i], quantities[i], sides[i], prices[i]
+            if row < 0:
+                reason = "unknown account"
+            elif side not in ('buy', 'sell'):
+                reason = f"invalid side '{side}'"
+            elif not quantity > 0:
+                reason = "quantity must be positive"
+            elif col < 0 or not known[(tickers[i], fields[i])]:
+                reason = "unknown ticker"
+            elif not valid_date[i]:
+                reason = "no valid date"
+            elif not np.isfinite(price):
+                reason = "no price"
+            elif side == 'buy' and price * quantity > cash[row]:
+                reason = "not enough cash"
+            elif side == 'sell' and held[i] + changes.get((row, col), 0.0) < quantity:
+                reason = "not enough shares"
+            else:
+                reason = None
+            if reason is not None:
+                rejections.append((i, accounts[i], tickers[i], side, quantity, reason))
+                continue
+            signed = quantity if side == 'buy' else -quantity
+            cash[row] -= price * signed
+            changes[(row, col)] = changes.get((row, col), 0.0) + signed
+            fill_rows.append(i)
+        self.cash = cash
+
+        if changes:
+            (change_rows, change_cols), deltas = zip(*changes.keys()), list(changes.values())
+            delta = sparse.csr_matrix((deltas, (change_rows, change_cols)), shape=self.holdings.shape)
+            self.holdings = self.holdings + delta
+            self.holdings.eliminate_zeros()
+
+        fill_rows = np.asarray(fill_rows, dtype=np.int64)
+        fill_sides = [sides[i] for i in fill_rows]
+        fill_totals = prices[fill_rows] * quantities[fill_rows]
+        fill_totals = np.where([side == 'buy' for side in fill_sides], -fill_totals, fill_totals)
+        fills = pd.DataFrame({
+            'order': fill_rows, 'account': [accounts[i] for i in fill_rows], 'ticker': [tickers[i] for i in fill_rows],
+            'side': fill_sides, 'date': self.calendar.index[positions[fill_rows]],
+            'quantity': quantities[fill_rows], 'price': prices[fill_rows], 'total': fill_totals
+        })
+        for account, group in fills.groupby('account', sort=False):
+            self.log(account).extend(['Buy' if side == 'buy' else 'Sell' for side in group['side']], group['date'],
+                                     group['ticker'].tolist(), group['quantity'].to_numpy(),
+                                     group['price'].to_numpy(), group['total'].to_numpy())
+        rejections = pd.DataFrame(rejections, columns=['order', 'account', 'ticker', 'side', 'quantity', 'reason'])
+        return fills, rejections
+
+    def nav(self, at_date=None) -> pd.Series:
+        """NAV of every account at the close of the last trading day on or before at_date (default last day)."""
+        prices = self._close_prices()[self._value_position(at_date)]
+        return pd.Series(self.holdings @ prices + self.cash, index=pd.Index(self.accounts, name='Account'), name='NAV')
+
+    def total_nav(self, at_date=None) -> float:
+        """NAV of the whole book."""
+        return float(self.nav(at_date).sum())
+
+    def nav_history(self, start_date=None, end_date=None) -> pd.DataFrame:
+        """
+        Daily NAV of every account with the current holdings and cash, dates x accounts.
+        Like Portfolio.portfolio_returns it shows how today's book would have moved, not the historical holdings.
+        """
+        lo, hi = self.calendar.slice_positions(start_date, end_date)
+        close = self._close_prices()[lo:hi]
+        values = np.asarray((self.holdings @ close.T).T) + self.cash
+        return pd.DataFrame(values, index=self.calendar.index[lo:hi], columns=pd.Index(self.accounts, name='Account'))
+
+    def returns(self, start_date=None, end_date=None, aggregate=False):
+        """Daily returns of every account (dates x accounts), or of the whole book as one Series if aggregate is True."""
+        history = self.nav_history(start_date, end_date)
+        if aggregate:
+            history = history.sum(axis=1).rename('Book')
+        return history.pct_change().iloc[1:]
+
+    def exposure(self, at_date=None, by='ticker') -> pd.DataFrame:
+        """
+        Market value of the positions at the close on or before at_date, accounts x tickers,
+        or accounts x sectors with by='sector'. Only tickers held by some account are included.
+        """
+        prices = self._close_prices()[self._value_position(at_date)]
+        values = self.holdings.multiply(prices[np.newaxis, :]).tocsc()
+        held = np.flatnonzero(np.diff(values.indptr))
+        if by == 'sector':
+            sectors = map_sectors(self.metadata, self.tickers[held])
+            codes, names = pd.factorize(sectors)
+            indicator = sparse.csr_matrix((np.ones(len(held)), (np.arange(len(held)), codes)), shape=(len(held), len(names)))
+            matrix = (values[:, held] @ indicator).toarray()
+            columns = pd.Index(names, name='Sector')
+        elif by == 'ticker':
+            matrix = values[:, held].toarray()
+            columns = self.tickers[held]
+        else:
+            raise ValueError("by must be 'ticker' or 'sector'")
+        return pd.DataFrame(matrix, index=pd.Index(self.accounts, name='Account'), columns=columns)
+
+    def aggregate_exposure(self, at_date=None, by='ticker') -> pd.Series:
+        """Market value of the whole book per ticker or per sector."""
+        return self.exposure(at_date, by).sum(axis=0).sort_values(ascending=False)
@@ -50,10 +50,7 @@ class CashFlow(ABC):
         portfolio.adjust_cash(net_amount, at_date=self.date)
         self.applied = True
         
-        log_msg = f"{flow_type} of {net_amount:.2f} applied to {asset_id}"
-        if tax:
-            log_msg += f" (tax: {tax:.2f})"
-        print(log_msg)
+        portfolio.sink.emit('cash_flow', flow_type=flow_type, amount=net_amount, asset_id=asset_id, tax=tax, date=self.date)
                 
     def __repr__(self):
         return f"{self.__class__.__name__}(amount={self.amount:.2f}, date={self.date}, metadata={self.metadata})"
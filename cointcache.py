@@ -0,0 +1,173 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from cointegration import coint_pvalues
+
+default_cache_path = 'data/coint_cache.parquet'
+key_columns = ['Ticker1', 'Ticker2', 'Start', 'End']
+cache_columns = key_columns + ['Hash1', 'Hash2', 'pvalue', 'Tested']
+
+
+def series_hash(values: np.ndarray, dates) -> str:
+    """Content hash of one price series and its dates. All missing values hash the same, whatever their NaN bits."""
+    values = np.where(np.isfinite(values), values, np.nan).astype(float)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.asarray(dates, dtype='datetime64[ns]').view(np.int64).tobytes())
+    digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+class CointegrationCache:
+    """
+    On-disk cache of Engle-Granger p-values, so a daily re-screening only tests the pairs whose prices changed.
+    An entry is keyed by the pair (ticker1 regressed on ticker2), the first and last date of the tested range and a
+    content hash of each of the two close series over that range. A revised price or another start date gives
+    another hash or key, and the pair is tested again.
+
+    New bars alone do not trigger a retest: the p-value of an entry is reused while the only change is at most
+    max_new_bars (default 5) new bars after its last date, checked by hashing the current series up to that date.
+    Reused entries keep their old last date, so a daily rescreen retests each pair once every max_new_bars + 1 days and
+    reads it from the cache on the other days. Pairs tested on the same day are retested together, so the saving is
+    on average, not on every day. max_new_bars=0 reuses only exact matches, and then every new bar retests every pair.
+
+    The table is stored as one parquet file, written atomically by save(). save() first evicts entries tested more than
+    max_age_days ago and then the oldest entries beyond max_entries.
+    """
+    def __init__(self, path=default_cache_path, max_entries=None, max_age_days=None, max_new_bars=5):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.max_new_bars = max_new_bars
+        self.table = self._load()
+        self.stats = {'hits': 0, 'stale_hits': 0, 'tested': 0}
+
+    def __repr__(self):
+        return f"CointegrationCache(path={self.path!r}, entries={len(self.table)})"
+
+    def __len__(self):
+        return len(self.table)
+
+    def _load(self) -> pd.DataFrame:
+        if os.path.exists(self.path):
+            return pd.read_parquet(self.path)[cache_columns]
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in
+                             zip(cache_columns, ['object'] * 2 + ['datetime64[ns]'] * 2 + ['object'] * 2 + ['float64', 'datetime64[ns]'])})
+
+    def pvalues(self, close: np.ndarray, index, tickers, first, second, batch_size=128) -> np.ndarray:
+        """
+        Same as cointegration.coint_pvalues(close, first, second), but pairs with a valid entry are read from the cache
+        and only the rest are tested. New results are added to the table, call save() to write it.
+
+        Args:
+            close (np.ndarray): Dates x tickers prices
+            index (pd.DatetimeIndex): Dates of the rows of close
+            tickers (list): Tickers of the columns of close
+            first, second (array of int): Column indices of the pairs
+        """
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        pvalues, found = self.lookup(close, index, tickers, first, second)
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            pvalues[missing] = coint_pvalues(close, first[missing], second[missing], batch_size=batch_size)
+            self.store(close, index, tickers, first[missing], second[missing], pvalues[missing])
+        return pvalues
+
+    def _request(self, close, index, tickers, first, second) -> pd.DataFrame:
+        hashes = np.array([series_hash(close[:, j], index) for j in range(close.shape[1])], dtype=object)
+        return pd.DataFrame({'Ticker1': tickers[first], 'Ticker2': tickers[second],
+                             'Hash1': hashes[first], 'Hash2': hashes[second], 'position': np.arange(len(first))})
+
+    def lookup(self, close: np.ndarray, index, tickers, first, second):
+        """
+        Cached p-values of the pairs, without testing anything.
+        Returns (pvalues, found), where found marks the pairs that were in the cache. Arguments as in pvalues().
+        """
+        index = pd.DatetimeIndex(index)
+        tickers = pd.Index(tickers)
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        pvalues = np.full(len(first), np.nan)
+        found = np.zeros(len(first), dtype=bool)
+        if len(first) == 0 or len(index) == 0:
+            return pvalues, found
+        request = self._request(close, index, tickers, first, second)
+
+        # Præcise hits: samme par, datoer og indhold
+        entries = self.table[(self.table['Start'] == index[0]) & (self.table['End'] == index[-1])]
+        exact = request.merge(entries, on=['Ticker1', 'Ticker2', 'Hash1', 'Hash2'])
+        pvalues[exact['position'].to_numpy()] = exact['pvalue'].to_numpy()
+        found[exact['position'].to_numpy()] = True
+        self.stats['hits'] += len(exact)
+
+        # Forældede hits: kun op til max_new_bars nye dage efter entryens sidste dato
+        if self.max_new_bars > 0 and not found.all():
+            stale = self._stale_hits(close, index, tickers, request[~found])
+            pvalues[stale['position'].to_numpy()] = stale['pvalue'].to_numpy()
+            found[stale['position'].to_numpy()] = True
+            self.stats['stale_hits'] += len(stale)
+        return pvalues, found
+
+    def store(self, close: np.ndarray, index, tickers, first, second, pvalues) -> None:
+        """Adds the p-values of newly tested pairs to the table. Arguments as in pvalues(), call save() to write it."""
+        index = pd.DatetimeIndex(index)
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        if len(first) == 0 or len(index) == 0:
+            return
+        new = self._request(close, index, pd.Index(tickers), first, second).drop(columns='position')
+        new = new.assign(Start=index[0], End=index[-1], pvalue=np.asarray(pvalues, dtype=float), Tested=pd.Timestamp.now())
+        table = pd.concat([self.table, new[cache_columns]], ignore_index=True) if len(self.table) else new[cache_columns]
+        self.table = table.drop_duplicates(subset=key_columns, keep='last').reset_index(drop=True)
+        self.stats['tested'] += len(first)
+
+    def _stale_hits(self, close, index, tickers, request: pd.DataFrame) -> pd.DataFrame:
+        """Entries of the requested pairs with the same start, ending at most max_new_bars bars before the end of index."""
+        start, end = index[0], index[-1]
+        entries = self.table[(self.table['Start'] == start) & (self.table['End'] < end)]
+        entries = entries.sort_values('End').drop_duplicates(subset=['Ticker1', 'Ticker2'], keep='last')
+        candidates = request.drop(columns=['Hash1', 'Hash2']).merge(entries, on=['Ticker1', 'Ticker2'])
+        if candidates.empty:
+            return candidates
+        new_bars = len(index) - index.searchsorted(candidates['End'].to_numpy(), side='right')
+        candidates = candidates[new_bars <= self.max_new_bars]
+
+        #hash af de nuværende serier frem til entryens sidste dato, en gang pr. ticker og dato
+        prefix_hashes = {}
+        def prefix_hash(ticker, entry_end):
+            if (ticker, entry_end) not in prefix_hashes:
+                rows = index.searchsorted(entry_end, side='right')
+                prefix_hashes[(ticker, entry_end)] = series_hash(close[:rows, tickers.get_loc(ticker)], index[:rows])
+            return prefix_hashes[(ticker, entry_end)]
+        same = [prefix_hash(t1, entry_end) == hash1 and prefix_hash(t2, entry_end) == hash2 for t1, t2, entry_end, hash1, hash2
+                in zip(candidates['Ticker1'], candidates['Ticker2'], candidates['End'], candidates['Hash1'], candidates['Hash2'])]
+        return candidates[np.array(same, dtype=bool)]
+
+    def evict(self, now=None) -> int:
+        """Removes entries older than max_age_days, then the oldest beyond max_entries. Returns the number removed."""
+        before = len(self.table)
+        table = self.table
+        if self.max_age_days is not None:
+            now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+            table = table[table['Tested'] >= now - pd.Timedelta(days=self.max_age_days)]
+        if self.max_entries is not None and len(table) > self.max_entries:
+            table = table.sort_values('Tested', kind='stable').iloc[len(table) - self.max_entries:]
+        self.table = table.reset_index(drop=True)
+        return before - len(self.table)
+
+    def save(self) -> None:
+        """Evicts old entries and writes the table to a temporary file that is renamed into place."""
+        self.evict()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        self.table.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+
+    def clear(self) -> None:
+        """Empties the cache and deletes the file."""
+        self.table = self.table.iloc[0:0]
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,217 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from statsmodels.tsa.adfvalues import mackinnonp
+from metadata import unknown_sector
+
+min_observations = 100 #samme grænse som find_cointegrated_pairs altid har brugt
+collinear_r2 = 1 - 100 * np.sqrt(np.finfo(float).eps) #samme grænse som statsmodels coint
+
+
+#Batched Engle-Granger: samme test som statsmodels.tsa.stattools.coint(y, x) med trend='c', autolag='aic',
+#men regnet for mange par på en gang med matrixalgebra i stedet for en OLS pr. par og pr. lag.
+
+def _lag_design(resid: np.ndarray, lags: int, start: int):
+    """
+    ADF design for every pair (rows of resid): the target diff(e)[t] and the regressors e[t-1], diff(e)[t-1..t-lags],
+    for t from start on, like adfuller's lagmat(..., trim='both') with the level in the first column.
+    """
+    diff = np.diff(resid, axis=1)
+    windows = sliding_window_view(diff, lags + 1, axis=1)[:, start - lags:] #vindue [t-lags, t] for hver t
+    target = windows[:, :, lags]
+    level = resid[:, start:-1]
+    design = np.concatenate([level[:, :, None], windows[:, :, :lags][:, :, ::-1]], axis=2)
+    return design, target
+
+def _adf_n(resid: np.ndarray) -> np.ndarray:
+    """
+    ADF t-statistics with regression='n' and the lag length chosen by AIC, for every row of resid (pairs x dates).
+    All candidate lags are fitted from one Cholesky factorization of the largest design per pair, since the sum of
+    squared residuals of the nested models are the cumulative sums of the squared forward-substituted moments.
+    """
+    n_pairs, n_dates = resid.shape
+    maxlag = int(np.ceil(12.0 * np.power(n_dates / 100.0, 1 / 4.0)))
+    maxlag = min(n_dates // 2 - 1, maxlag)
+
+    # Lagvalg: alle lag på de samme observationer, som i adfuller
+    design, target = _lag_design(resid, maxlag, maxlag)
+    nobs = target.shape[1]
+    gram = np.matmul(design.transpose(0, 2, 1), design)
+    moments = np.einsum('pnk,pn->pk', design, target)
+    total = np.einsum('pn,pn->p', target, target)
+    try:
+        chol = np.linalg.cholesky(gram)
+        forward = np.linalg.solve(chol, moments[:, :, None])[:, :, 0]
+        ssr = total[:, None] - np.cumsum(forward * forward, axis=1)
+    except np.linalg.LinAlgError: #singulær design, tag parrene et ad gangen
+        ssr = np.empty((n_pairs, maxlag + 1))
+        for p in range(n_pairs):
+            for k in range(1, maxlag + 2):
+                coef = np.linalg.lstsq(design[p, :, :k], target[p], rcond=None)[0]
+                ssr[p, k - 1] = np.sum((target[p] - design[p, :, :k] @ coef) ** 2)
+    n_params = np.arange(1, maxlag + 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        llf = -nobs / 2.0 * (np.log(2 * np.pi) + np.log(np.maximum(ssr, 0.0) / nobs) + 1)
+    aic = -2.0 * llf + 2.0 * n_params
+    used_lags = np.argmin(np.where(np.isnan(aic), np.inf, aic), axis=1) #første minimum, som min((aic, lag)) i statsmodels
+
+    # Endelig regression med det valgte lag, på alle de observationer det lag tillader
+    stats = np.full(n_pairs, np.nan)
+    for lag in np.unique(used_lags):
+        rows = np.flatnonzero(used_lags == lag)
+        design, target = _lag_design(resid[rows], lag, lag)
+        gram = np.matmul(design.transpose(0, 2, 1), design)
+        moments = np.einsum('pnk,pn->pk', design, target)
+        try:
+            inverse = np.linalg.inv(gram)
+        except np.linalg.LinAlgError:
+            inverse = np.linalg.pinv(gram)
+        coef = np.einsum('pkl,pl->pk', inverse, moments)
+        residuals = target - np.einsum('pnk,pk->pn', design, coef)
+        dof = target.shape[1] - (lag + 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.einsum('pn,pn->p', residuals, residuals) / dof
+            stats[rows] = coef[:, 0] / np.sqrt(scale * inverse[:, 0, 0])
+    return stats
+
+def _engle_granger(y: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """Cointegration test statistics of y on x (both dates x pairs, no missing values) with a constant."""
+    x_centered = x - x.mean(axis=0)
+    y_centered = y - y.mean(axis=0)
+    sxx = np.einsum('tp,tp->p', x_centered, x_centered)
+    sxy = np.einsum('tp,tp->p', x_centered, y_centered)
+    syy = np.einsum('tp,tp->p', y_centered, y_centered)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = sxy / sxx
+        resid = y_centered - beta * x_centered
+        r2 = 1 - np.einsum('tp,tp->p', resid, resid) / syy
+
+    stats = np.full(y.shape[1], -np.inf) #(næsten) kollineære par får -inf og p-værdi 0, som i coint
+    testable = ~(r2 >= collinear_r2) & np.isfinite(beta)
+    if testable.any():
+        stats[testable] = _adf_n(np.ascontiguousarray(resid[:, testable].T))
+    return stats
+
+
+def coint_pvalues(close: np.ndarray, first, second, batch_size=128) -> np.ndarray:
+    """
+    Engle-Granger cointegration p-values for many pairs of columns of a dates x tickers close matrix,
+    the same as statsmodels coint(close[:, first], close[:, second]) on the dates where both have a price,
+    with each series normalized by its first price like find_cointegrated_pairs.
+
+    Tickers are grouped by which dates they have prices on, so every group of pairs with the same common dates
+    is cleaned once and tested in batches of batch_size pairs.
+    Pairs with fewer than 100 common dates or a zero first price get NaN.
+
+    Args:
+        close (np.ndarray): Dates x tickers prices, NaN or inf where missing
+        first, second (array of int): Column indices of the pairs, the first column is regressed on the second
+        batch_size (int, optional): Pairs per batch, bounds memory to about batch_size * dates * 30 floats.
+    """
+    close = np.asarray(close, dtype=float)
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    pvalues = np.full(len(first), np.nan)
+    if len(first) == 0:
+        return pvalues
+
+    valid = np.isfinite(close)
+    masks, group = np.unique(valid.T, axis=0, return_inverse=True)
+    group = group.ravel()
+    pair_group = group[first] * len(masks) + group[second]
+    for key in np.unique(pair_group):
+        pairs = np.flatnonzero(pair_group == key)
+        rows = masks[key // len(masks)] & masks[key % len(masks)]
+        if rows.sum() < min_observations:
+            continue
+        common = close[rows]
+        for lo in range(0, len(pairs), batch_size):
+            batch = pairs[lo:lo + batch_size]
+            y = common[:, first[batch]]
+            x = common[:, second[batch]]
+            nonzero = (y[0] != 0) & (x[0] != 0)
+            if not nonzero.any():
+                continue
+            batch = batch[nonzero]
+            stats = _engle_granger(y[:, nonzero] / y[0, nonzero], x[:, nonzero] / x[0, nonzero])
+            pvalues[batch] = [mackinnonp(stat, regression='c', N=2) for stat in stats]
+    return pvalues
+
+
+def _masked_products(values: np.ndarray, valid: np.ndarray):
+    """Pairwise sums over the dates where both columns are valid: count, sum of column i, sum of squares of column i and cross products."""
+    weights = valid.astype(float)
+    clean = np.where(valid, values, 0.0)
+    count = weights.T @ weights
+    sums = clean.T @ weights #[i, j] = sum af kolonne i på datoer hvor j også er gyldig
+    squares = (clean * clean).T @ weights
+    return count, sums, squares, clean.T @ clean
+
+def pair_measures(close: np.ndarray):
+    """
+    Cheap similarity measures for every pair of columns of a dates x tickers close matrix, on the dates where both have a price:
+    the mean squared distance between the prices normalized by their first price, and the correlation of daily returns.
+    Returns two tickers x tickers matrices (distance, correlation).
+    """
+    close = np.asarray(close, dtype=float)
+    valid = np.isfinite(close)
+    first_price = close[np.argmax(valid, axis=0), np.arange(close.shape[1])]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        normalized = close / first_price
+        count, sums, squares, cross = _masked_products(normalized, valid & np.isfinite(normalized))
+        distance = (squares + squares.T - 2 * cross) / count
+
+        returns = close[1:] / close[:-1] - 1
+        count, sums, squares, cross = _masked_products(returns, np.isfinite(returns))
+        covariance = cross - sums * sums.T / count
+        variance = squares - sums * sums / count
+        correlation = covariance / np.sqrt(variance * variance.T)
+    return distance, correlation
+
+def prescreen_pairs(close: np.ndarray, first, second, sectors=None, same_sector=False, min_correlation=None,
+                    max_distance=None, top_n=None, rank_by='distance'):
+    """
+    Filters candidate pairs before the cointegration test with the cheap measures of pair_measures.
+    The filters run in the order of the arguments, and the pairs that are kept stay in their original order.
+
+    Args:
+        close (np.ndarray): Dates x tickers prices
+        first, second (array of int): Column indices of the candidate pairs
+        sectors (array, optional): Sector of every column, e.g. metadata.map_sectors(metadata, tickers)
+        same_sector (bool, optional): Only keep pairs in the same sector. Tickers with an unknown sector are dropped.
+        min_correlation (float, optional): Only keep pairs with a daily return correlation of at least this
+        max_distance (float, optional): Only keep pairs with a mean squared distance of normalized prices of at most this
+        top_n (int, optional): Keep the top_n best remaining pairs by rank_by
+        rank_by (str, optional): 'distance' (smallest first) or 'correlation' (largest first)
+
+    Returns:
+        tuple: (first, second, funnel) with the kept pairs and a dict of the number of pairs left after each stage.
+    """
+    if rank_by not in ('distance', 'correlation'):
+        raise ValueError("rank_by must be 'distance' or 'correlation'")
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    keep = np.arange(len(first))
+    funnel = {'candidates': len(keep)}
+
+    if same_sector:
+        if sectors is None:
+            raise ValueError("same_sector needs the sectors of the tickers")
+        sectors = np.asarray(sectors, dtype=object)
+        same = (sectors[first] == sectors[second]) & (sectors[first] != unknown_sector)
+        keep = keep[same[keep]]
+        funnel['same_sector'] = len(keep)
+
+    distance, correlation = pair_measures(close)
+    pair_distance = distance[first, second]
+    pair_correlation = correlation[first, second]
+    if min_correlation is not None:
+        keep = keep[pair_correlation[keep] >= min_correlation]
+        funnel['min_correlation'] = len(keep)
+    if max_distance is not None:
+        keep = keep[pair_distance[keep] <= max_distance]
+        funnel['max_distance'] = len(keep)
+    if top_n is not None:
+        score = pair_distance[keep] if rank_by == 'distance' else -pair_correlation[keep]
+        keep = np.sort(keep[np.argsort(score, kind='stable')[:top_n]]) #NaN sorteres sidst
+        funnel['top_n'] = len(keep)
+    return first[keep], second[keep], funnel
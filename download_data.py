@@ -1,49 +1,372 @@
 import os
+import glob
+import ast
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
-import yfinance as yf
+import pyarrow.parquet as pq
+from providers import MarketDataProvider, YFinanceProvider
+from metadata import build_metadata, metadata_from_frame
 
-local_save_path = 'data/yfinancedata.parquet'
+local_save_path = 'data/yfinancedata.parquet' #gammelt format, en samlet fil
+local_store_path = 'data/prices'
+default_start_date = "2015-01-01"
+metadata_file = 'metadata.parquet'
+legacy_sectors_file = 'sectors.parquet' #sektortabellen fra før metadata.parquet, flyttes af load_metadata
+progress_file = '_progress.json'
+row_group_size = 252 #ca. et handelsår pr. row group, så datofiltre kan springe resten over
 
-#web scrape fra wikipedia
-def fetch_sp500_tickers():
+default_provider = YFinanceProvider()
+
+def fetch_sp500_tickers(provider: MarketDataProvider = None):
     "Returns tickers and sectors. List and dictornary mapping sectors to the tickers."
+    provider = provider or default_provider
+    return provider.fetch_tickers()
+
+def _ticker_path(store_path, ticker, year=None) -> str:
+    """Path of a ticker partition. Year partitions live in a folder per ticker."""
+    if year is None:
+        return os.path.join(store_path, f"{ticker}.parquet")
+    return os.path.join(store_path, ticker, f"{year}.parquet")
+
+def _ticker_files(store_path, ticker) -> list:
+    """All parquet files holding bars for a ticker, oldest partition first."""
+    single = _ticker_path(store_path, ticker)
+    if os.path.exists(single):
+        return [single]
+    return sorted(glob.glob(os.path.join(store_path, ticker, "*.parquet")))
+
+def stored_tickers(store_path=local_store_path) -> list:
+    """Returns the tickers that have at least one partition in the store."""
+    if not os.path.isdir(store_path):
+        return []
+    tickers = set()
+    for entry in os.listdir(store_path):
+        path = os.path.join(store_path, entry)
+        if entry.endswith('.parquet') and entry not in (metadata_file, legacy_sectors_file):
+            tickers.add(entry[:-len('.parquet')])
+        elif os.path.isdir(path) and glob.glob(os.path.join(path, "*.parquet")):
+            tickers.add(entry)
+    return sorted(tickers)
+
+def last_stored_date(ticker, store_path=local_store_path):
+    """Returns the last stored bar date for a ticker, or None if nothing is stored."""
+    files = _ticker_files(store_path, ticker)
+    if not files:
+        return None
+    #kun den nyeste partition og kun datokolonnen skal læses
+    dates = pd.read_parquet(files[-1], columns=[]).index
+    if len(dates) == 0:
+        return None
+    return dates.max()
+
+def _write_atomic(df: pd.DataFrame, path: str) -> None:
+    """Writes to a temporary file and renames it into place, so readers never see a half written partition."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, row_group_size=row_group_size)
+    os.replace(tmp_path, path)
+
+def _split_by_ticker(data: pd.DataFrame, tickers) -> dict:
+    """Splits a wide (ticker, field) frame into one frame of bars per ticker, without empty rows."""
+    bars = {}
+    if data is None or data.empty:
+        return bars
+    available = data.columns.get_level_values(0)
+    for ticker in tickers:
+        if ticker not in available:
+            continue
+        ticker_bars = data[ticker].dropna(how='all')
+        if ticker_bars.empty:
+            continue
+        ticker_bars.index = pd.DatetimeIndex(ticker_bars.index, name='Date')
+        ticker_bars.columns.name = None
+        bars[ticker] = ticker_bars
+    return bars
+
+def _merge_ticker(ticker, new_bars: pd.DataFrame, store_path, by_year=False) -> int:
+    """Merges new bars into the stored partitions of a ticker. Returns number of rows written."""
+    if by_year:
+        groups = new_bars.groupby(new_bars.index.year)
+    else:
+        groups = [(None, new_bars)]
+
+    for year, bars in groups:
+        path = _ticker_path(store_path, ticker, year)
+        if os.path.exists(path):
+            existing = pd.read_parquet(path)
+            bars = pd.concat([existing, bars])
+            bars = bars[~bars.index.duplicated(keep='last')] #nye bars vinder over gamle
+        _write_atomic(bars.sort_index(), path)
+    return len(new_bars)
+
+def save_metadata(sectors: dict, store_path=local_store_path) -> None:
+    """Stores the static ticker metadata (sectors) as a small table next to the price partitions."""
+    path = os.path.join(store_path, metadata_file)
+    stored = load_metadata(store_path)['Sector'].astype('object').to_dict() #også en gammel sectors.parquet
+    stored.update(sectors)
+    _write_atomic(build_metadata(stored), path)
+
+def load_metadata(file_path=local_store_path) -> pd.DataFrame:
+    """
+    Returns the metadata table, indexed by ticker with a categorical Sector column.
+    For a legacy single-file store the table is extracted from its Sector columns.
+    A store with the old sectors.parquet (Ticker, Sector) table is migrated to metadata.parquet on first load.
+    """
+    if os.path.isfile(file_path):
+        sector_columns = [name for name in pq.read_schema(file_path).names if name.endswith("'Sector')")]
+        return metadata_from_frame(pd.read_parquet(file_path, columns=sector_columns))
+    path = os.path.join(file_path, metadata_file)
+    legacy_path = os.path.join(file_path, legacy_sectors_file)
+    if not os.path.exists(path) and os.path.exists(legacy_path):
+        table = pd.read_parquet(legacy_path)
+        _write_atomic(build_metadata(dict(zip(table['Ticker'], table['Sector']))), path)
+        os.remove(legacy_path) #først når metadata.parquet er skrevet
+    if not os.path.exists(path):
+        return build_metadata({})
+    return pd.read_parquet(path)
+
+class _RateLimiter:
+    """Allows at most `rate` requests per second across all download threads."""
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+def _fetch_with_retry(provider, chunk, start, end, limiter, retries, backoff):
+    """Fetches one chunk, retrying with exponential backoff. Returns the bars and the number of retries used."""
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return provider.fetch_bars(chunk, start, end), attempt
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+def _load_progress(store_path, end) -> set:
+    """Tickers already finished by an interrupted run with the same end date."""
+    path = os.path.join(store_path, progress_file)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        progress = json.load(f)
+    if progress.get('end') != end.strftime("%Y-%m-%d"):
+        return set()
+    return set(progress.get('done', []))
+
+def _save_progress(store_path, end, done) -> None:
+    os.makedirs(store_path, exist_ok=True)
+    path = os.path.join(store_path, progress_file)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'end': end.strftime("%Y-%m-%d"), 'done': sorted(done)}, f)
+    os.replace(path + '.tmp', path)
 
-    sp500 = pd.read_html("https://en.wikipedia.org/wiki/List_of_S%26P_500_companies")[0]
-    sp500['Symbol'] = sp500['Symbol'].str.replace(".", "-")
-    tickers = sp500['Symbol'].tolist()
-    sectors = dict(zip(sp500['Symbol'], sp500['GICS Sector']))
-    return tickers, sectors
+def download_chunked(tickers, sectors=None, store_path=local_store_path, start=default_start_date, end=None,
+                     provider: MarketDataProvider = None, by_year=False, chunk_size=50, max_workers=4,
+                     retries=3, backoff=1.0, rate_limit=None) -> dict:
+    """
+    Appends new bars to the partitioned store. Only bars after each ticker's last stored date are fetched.
+    The tickers are split into chunks that are fetched concurrently. Every finished chunk is merged into the
+    store right away and recorded in a progress file, so an interrupted run resumes where it stopped.
 
-def download_and_save_data(tickers, sectors, save_path=local_save_path):
-    if os.path.exists(save_path):
-        print("Data already exists. Delete it to re-download.")
-        return
+    Args:
+        tickers (list): Tickers to refresh
+        sectors (dict, optional): Ticker -> sector mapping stored in the metadata table
+        store_path (str): Folder with one partition per ticker
+        start (str): First date fetched for tickers that are not stored yet
+        end (str, optional): Exclusive end date. Defaults to today.
+        provider (MarketDataProvider, optional): Source of the bars. Defaults to yfinance.
+        by_year (bool): Partition each ticker further by year
+        chunk_size (int): Tickers per request
+        max_workers (int): Maximum number of requests in flight
+        retries (int): Retries per chunk before it is reported as failed
+        backoff (float): Base delay in seconds between retries, doubled for every attempt
+        rate_limit (float, optional): Maximum requests per second
 
+    Returns:
+        dict: 'written' (ticker -> new rows), 'failed' (tickers of failed chunks) and throughput metrics
+    """
+    provider = provider or default_provider
+    end = pd.to_datetime(end) if end is not None else pd.to_datetime('today').normalize()
+    started = time.perf_counter()
+    done = _load_progress(store_path, end)
+
+    #grupper tickers efter hvor de skal hentes fra, så tickers med samme sidste dato hentes sammen
+    requests = {}
+    for ticker in tickers:
+        if ticker in done:
+            continue
+        last_date = last_stored_date(ticker, store_path)
+        fetch_start = pd.to_datetime(start) if last_date is None else last_date + pd.Timedelta(days=1)
+        if fetch_start >= end:
+            continue
+        requests.setdefault(fetch_start, []).append(ticker)
+    chunks = [(fetch_start, group[i:i + chunk_size])
+              for fetch_start, group in requests.items()
+              for i in range(0, len(group), chunk_size)]
+
+    written = {}
+    failed = []
+    failed_chunks = 0
+    n_retries = 0
+    limiter = _RateLimiter(rate_limit)
+    end_str = end.strftime("%Y-%m-%d")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_fetch_with_retry, provider, chunk, fetch_start.strftime("%Y-%m-%d"), end_str,
+                        limiter, retries, backoff): (fetch_start, chunk)
+            for fetch_start, chunk in chunks
+        }
+        for future in as_completed(futures):
+            fetch_start, chunk = futures[future]
+            try:
+                data, used_retries = future.result()
+            except Exception as e:
+                print(f"Chunk {chunk[0]}..{chunk[-1]} failed after {retries} retries: {e}")
+                failed.extend(chunk)
+                failed_chunks += 1
+                n_retries += retries
+                continue
+            n_retries += used_retries
+            #skrivning sker kun fra denne tråd, så partitionerne aldrig skrives samtidigt
+            for ticker, bars in _split_by_ticker(data, chunk).items():
+                bars = bars.loc[bars.index >= fetch_start]
+                if not bars.empty:
+                    written[ticker] = _merge_ticker(ticker, bars, store_path, by_year)
+            done.update(chunk)
+            _save_progress(store_path, end, done)
+
+    if sectors:
+        save_metadata({ticker: sectors.get(ticker, 'Unknown') for ticker in tickers}, store_path)
+    if not failed and os.path.exists(os.path.join(store_path, progress_file)):
+        os.remove(os.path.join(store_path, progress_file)) #alt er hentet, næste kørsel starter forfra
+
+    seconds = time.perf_counter() - started
+    rows = sum(written.values())
+    return {
+        'written': written,
+        'failed': failed,
+        'chunks': len(chunks),
+        'failed_chunks': failed_chunks,
+        'retries': n_retries,
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds > 0 else 0.0,
+        'tickers_per_second': len(written) / seconds if seconds > 0 else 0.0,
+    }
+
+def update_data(tickers, sectors=None, store_path=local_store_path, start=default_start_date, end=None, provider: MarketDataProvider = None, by_year=False, **download_options) -> dict:
+    """
+    Appends new bars to the partitioned store, see download_chunked for the options.
+
+    Returns:
+        dict: ticker -> number of new rows written
+    """
+    stats = download_chunked(tickers, sectors, store_path, start, end, provider, by_year, **download_options)
+    return stats['written']
+
+def download_and_save_data(tickers, sectors, save_path=local_store_path, provider: MarketDataProvider = None, by_year=False, **download_options):
+    """Downloads missing history into the partitioned store. Re-running only fetches bars that are not stored yet."""
     print("Downloading historical data...")
-    data = yf.download(
-        tickers, 
-        start="2015-01-01", 
-        end=pd.to_datetime('today').strftime("%Y-%m-%d"), 
-        group_by='ticker',
-        progress=False
-    )
-
-    sector_data = pd.DataFrame(
-        { (ticker, 'Sector'): sectors.get(ticker, 'Unknown') for ticker in tickers },
-        index=data.index
-    )
-    data = pd.concat([data, sector_data], axis=1)
-
-
-    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-    data.to_parquet(save_path)
-    print(f"Data saved to {save_path}")
-
-def load_data(file_path=local_save_path):
+    stats = download_chunked(tickers, sectors, store_path=save_path, provider=provider, by_year=by_year, **download_options)
+    print(f"{stats['rows']} new rows for {len(stats['written'])} tickers saved to {save_path} "
+          f"({stats['chunks']} chunks, {stats['retries']} retries, {stats['seconds']:.1f}s, {stats['rows_per_second']:,.0f} rows/s)")
+    if stats['failed']:
+        print(f"{len(stats['failed'])} tickers failed, run again to resume.")
+
+def _date_filters(start=None, end=None) -> list:
+    """Row filters on the Date column, pushed down to the parquet reader."""
+    filters = []
+    if start is not None:
+        filters.append(('Date', '>=', pd.to_datetime(start)))
+    if end is not None:
+        filters.append(('Date', '<=', pd.to_datetime(end)))
+    return filters or None
+
+def _partition_in_range(path, start=None, end=None) -> bool:
+    """Skips year partitions that lie completely outside the requested date range."""
+    year = os.path.splitext(os.path.basename(path))[0]
+    if not year.isdigit():
+        return True
+    year = int(year)
+    if start is not None and year < pd.to_datetime(start).year:
+        return False
+    if end is not None and year > pd.to_datetime(end).year:
+        return False
+    return True
+
+def _load_legacy_file(file_path, tickers=None, fields=None, start=None, end=None) -> pd.DataFrame:
+    """Reads the old single-file format. Columns are stored as "('TICKER', 'Field')" strings."""
+    columns = []
+    for name in pq.read_schema(file_path).names:
+        if not name.startswith('('):
+            continue #index kolonne
+        ticker, field = ast.literal_eval(name)
+        if field == 'Sector':
+            continue #ligger i metadata tabellen
+        if (tickers is None or ticker in tickers) and (fields is None or field in fields):
+            columns.append(name)
+    return pd.read_parquet(file_path, columns=columns, filters=_date_filters(start, end))
+
+def load_data(file_path=local_store_path, tickers=None, fields=None, start=None, end=None):
+    """
+    Loads the wide (ticker, field) price frame from the partitioned store, or from a single legacy parquet file.
+    Ticker and field projection and the date range are pushed down to the parquet reader, so only the requested data is read.
+    Sectors are not part of the price frame, see load_metadata.
+
+    Args:
+        file_path (str): Store folder or legacy parquet file
+        tickers (list, optional): Tickers to load. Defaults to all stored tickers.
+        fields (list, optional): Fields to load, e.g. ['Close']. Defaults to all fields.
+        start (str, optional): First date to load (inclusive)
+        end (str, optional): Last date to load (inclusive)
+    """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File {file_path} does not exist.")
-    return pd.read_parquet(file_path)
-    
+    if isinstance(tickers, str):
+        tickers = [tickers]
+    if isinstance(fields, str):
+        fields = [fields]
+    if os.path.isfile(file_path):
+        return _load_legacy_file(file_path, tickers, fields, start, end)
+
+    stored = stored_tickers(file_path)
+    if tickers is not None:
+        stored_set = set(stored)
+        stored = [ticker for ticker in tickers if ticker in stored_set]
+    if not stored:
+        raise FileNotFoundError(f"No price partitions found in {file_path}.")
+
+    filters = _date_filters(start, end)
+
+    frames = {}
+    for ticker in stored:
+        parts = [pd.read_parquet(path, columns=fields, filters=filters)
+                 for path in _ticker_files(file_path, ticker) if _partition_in_range(path, start, end)]
+        parts = [part for part in parts if not part.empty]
+        if parts:
+            frames[ticker] = pd.concat(parts)
+    if not frames:
+        raise ValueError(f"No data found in {file_path} for the requested tickers and dates.")
+    data = pd.concat(frames, axis=1).sort_index()
+    data.columns = pd.MultiIndex.from_tuples(data.columns, names=['Ticker', 'Price'])
+    data.index.name = 'Date'
+    return data
+
 if __name__ == "__main__":
     tickers, sectors = fetch_sp500_tickers()
     data = load_data()
@@ -0,0 +1,95 @@
+import logging
+from collections import Counter, deque
+
+#Beskeder for hver event, samme tekst som de gamle print() kald
+messages = {
+    'buy': "Bought {quantity} shares of {ticker}, at {price} per share. Current holdings: {holdings} shares.",
+    'buy_rejected': "Not enough cash to buy {quantity} shares of {ticker}.",
+    'sell': "Sold {quantity} shares of {ticker}, at {price} per share. Remaining holdings: {holdings} shares.",
+    'sell_rejected': "Not enough shares of {ticker} to sell.",
+    'date_not_found': "Date {date} not found in data.",
+    'date_adjusted': "Using next available date: {date}",
+    'no_future_date': "No future dates available in data after {date}.",
+    'orders_executed': "Executed {fills} orders, rejected {rejections}.",
+    'cash_set': "Current cash set to {cash:.2f}.",
+    'cash_set_rejected': "Cash amount cannot be negative.",
+    'cash_adjusted': "Cash adjustet, new balance: {cash:.2f}.",
+    'cash_adjust_rejected': "Insufficient cash to adjust by this amount.",
+    'reset': "Portfolio {name} has been reset.",
+    'cash_flow': "{flow_type} of {amount:.2f} applied to {asset_id}",
+}
+
+
+def format_event(event: str, fields: dict) -> str:
+    """Formats an event as the human readable message the portfolio used to print."""
+    template = messages.get(event)
+    if template is None:
+        return f"{event}: {fields}"
+    message = template.format(**fields)
+    if event == 'cash_flow' and fields.get('tax'):
+        message += f" (tax: {fields['tax']:.2f})"
+    return message
+
+
+class EventSink:
+    """
+    Receives diagnostic events from Portfolio and cash flows. The base class discards everything,
+    so large simulations pay nothing for diagnostics.
+    """
+    def emit(self, event: str, **fields) -> None:
+        pass
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}()"
+
+
+class NullSink(EventSink):
+    """Discards all events. The default sink."""
+    pass
+
+
+class PrintSink(EventSink):
+    """Prints every event to stdout, like the portfolio always did before sinks existed."""
+    def emit(self, event: str, **fields) -> None:
+        print(format_event(event, fields))
+
+
+class RingBufferSink(EventSink):
+    """Keeps the last maxlen events in memory as (event, fields) tuples."""
+    def __init__(self, maxlen=10000):
+        self.events = deque(maxlen=maxlen)
+
+    def emit(self, event: str, **fields) -> None:
+        self.events.append((event, fields))
+
+    def messages(self) -> list:
+        return [format_event(event, fields) for event, fields in self.events]
+
+    def clear(self):
+        self.events.clear()
+
+    def __len__(self):
+        return len(self.events)
+
+
+class LoggingSink(EventSink):
+    """Sends events to a standard library logger, with the event name and fields attached as extra."""
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('portfolio')
+        self.level = level
+
+    def emit(self, event: str, **fields) -> None:
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, format_event(event, fields), extra={'event': event, 'fields': fields})
+
+
+class CounterSink(EventSink):
+    """Counts events per name without storing them."""
+    def __init__(self):
+        self.counts = Counter()
+
+    def emit(self, event: str, **fields) -> None:
+        self.counts[event] += 1
+
+    def __repr__(self):
+        return f"CounterSink({dict(self.counts)})"
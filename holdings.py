@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from pricecube import PriceCube, get_field_frame
+
+trade_types = ('Buy', 'Sell')
+
+
+class HoldingsHistory:
+    """
+    Daily holdings, cash, exposure and NAV of a portfolio, rebuilt from its transaction log.
+
+    Attributes:
+        holdings (pd.DataFrame): Shares held at the close of each day, one column per traded ticker
+        cash (pd.Series): Cash at the close of each day
+        exposure (pd.DataFrame): Market value of each position at the close of each day
+        nav (pd.Series): Total value (exposure + cash) at the close of each day
+        flows (pd.Series): External cash flows (cash adjustments, dividends etc.) booked on each day
+    """
+    def __init__(self, holdings: pd.DataFrame, cash: pd.Series, exposure: pd.DataFrame, flows: pd.Series):
+        self.holdings = holdings
+        self.cash = cash
+        self.exposure = exposure
+        self.flows = flows
+        self.nav = exposure.sum(axis=1) + cash
+
+    def __repr__(self):
+        if self.nav.empty:
+            return "HoldingsHistory(empty)"
+        return f"HoldingsHistory({self.nav.index[0].date()} to {self.nav.index[-1].date()}, tickers={self.holdings.shape[1]})"
+
+    def returns(self) -> pd.Series:
+        """Daily NAV returns with external cash flows taken out, so deposits do not count as performance."""
+        previous_nav = self.nav.shift(1)
+        returns = (self.nav - self.flows) / previous_nav - 1
+        return returns.iloc[1:].replace([np.inf, -np.inf], np.nan)
+
+    def weights(self) -> pd.DataFrame:
+        """Position weights of NAV on each day."""
+        return self.exposure.div(self.nav, axis=0)
+
+
+def holdings_history(portfolio, start_date=None, end_date=None) -> HoldingsHistory:
+    """
+    Turns the transaction log into daily holdings, cash and NAV in one vectorized pass.
+    Trades are scattered into a sparse dates x tickers matrix and cumulatively summed, cash is the
+    starting cash plus the cumulative sum of every logged total. Transactions on non-trading days count
+    from the next trading day. Missing prices of held positions are forward filled.
+
+    Args:
+        portfolio (Portfolio): Portfolio with data, calendar, log and starting_cash
+        start_date (str or pd.Timestamp, optional): First date of the returned series
+        end_date (str or pd.Timestamp, optional): Last date of the returned series
+    """
+    calendar = portfolio.calendar
+    n_dates = len(calendar)
+    log_df = portfolio.log.to_frame()
+
+    positions = calendar.index.searchsorted(pd.DatetimeIndex(log_df['Date']), side='left')
+    in_range = positions < n_dates #handler efter sidste dato i data tæller ikke med
+    types = log_df['Type'].astype(object).to_numpy()
+    is_trade = np.isin(types, trade_types) & in_range
+
+    # Sparse handelsmatrix: dato x ticker, kun de handlede tickers
+    trade_tickers = log_df['Ticker'].astype(object).to_numpy()[is_trade]
+    tickers, ticker_idx = np.unique(trade_tickers, return_inverse=True) if len(trade_tickers) else (np.empty(0, dtype=object), np.empty(0, dtype=np.int64))
+    quantities = log_df['Quantity'].to_numpy()[is_trade]
+    signed = np.where(types[is_trade] == 'Buy', quantities, -quantities)
+    trades = sparse.coo_matrix((signed, (positions[is_trade], ticker_idx)), shape=(n_dates, len(tickers)))
+    holdings = np.cumsum(trades.toarray(), axis=0)
+
+    # Kontanter: alle totaler (køb negative, salg og cash flows positive)
+    totals = log_df['Total'].to_numpy()
+    cash_changes = np.bincount(positions[in_range], weights=totals[in_range], minlength=n_dates)
+    cash = portfolio.starting_cash + np.cumsum(cash_changes)
+    is_flow = in_range & ~np.isin(types, trade_types)
+    flows = np.bincount(positions[is_flow], weights=totals[is_flow], minlength=n_dates)
+
+    if isinstance(portfolio.data, PriceCube):
+        close = portfolio.data.frame('Close', tickers=list(tickers))
+    else:
+        close = get_field_frame(portfolio.data, 'Close').reindex(columns=tickers)
+    close = close.ffill().to_numpy(dtype=float)
+    exposure = np.where(holdings != 0, holdings * close, 0.0)
+
+    lo, hi = calendar.slice_positions(start_date, end_date)
+    index = calendar.index[lo:hi]
+    columns = pd.Index(tickers, name='Ticker')
+    return HoldingsHistory(
+        holdings=pd.DataFrame(holdings[lo:hi], index=index, columns=columns),
+        cash=pd.Series(cash[lo:hi], index=index, name='Cash'),
+        exposure=pd.DataFrame(exposure[lo:hi], index=index, columns=columns),
+        flows=pd.Series(flows[lo:hi], index=index, name='Flows'),
+    )
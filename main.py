@@ -1,5 +1,6 @@
-from download_data import load_data, download_and_save_data, fetch_sp500_tickers
+from download_data import load_data, load_metadata, download_and_save_data, fetch_sp500_tickers
 from portfolio import Portfolio
+from events import PrintSink
 from cashflow import CashFlow, CashFlowManager, DerivativeCashFlow, DividendCashFlow, InterestCashFlow
 from riskmetrics import RiskMetrics
 from backtest import BackTester, find_cointegrated_pairs
@@ -13,9 +14,10 @@ import pandas as pd
 tickers, sectors= fetch_sp500_tickers()
 download_and_save_data(tickers,sectors)
 data = load_data()
+metadata = load_metadata()
 
 #Opret din portefølje
-pf = Portfolio(name="Hja", data=data, starting_cash=100000)
+pf = Portfolio(name="Hja", data=data, starting_cash=100000, metadata=metadata, sink=PrintSink())
 
 #Buy sell
 pf.buy_asset('AAPL', 10, at_date='2016-01-05')
@@ -0,0 +1,44 @@
+import pandas as pd
+
+unknown_sector = 'Unknown'
+
+
+def build_metadata(sectors: dict) -> pd.DataFrame:
+    """
+    Builds the static reference table from a ticker -> sector mapping.
+    One row per ticker, indexed by ticker, with Sector stored as a categorical.
+    """
+    table = pd.DataFrame({'Sector': pd.Series(sectors, dtype='object')})
+    table.index.name = 'Ticker'
+    table['Sector'] = table['Sector'].fillna(unknown_sector).astype('category')
+    return table
+
+def metadata_from_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """Extracts the metadata table from an old style price frame with (ticker, 'Sector') columns."""
+    if not isinstance(data, pd.DataFrame) or 'Sector' not in data.columns.get_level_values(1):
+        return build_metadata({})
+    sector_columns = data.xs('Sector', level=1, axis=1)
+    sectors = {}
+    for ticker in sector_columns.columns:
+        values = sector_columns[ticker].dropna()
+        sectors[ticker] = values.iloc[0] if not values.empty else unknown_sector
+    return build_metadata(sectors)
+
+def get_sector(metadata: pd.DataFrame, ticker) -> str:
+    """Sector of a ticker, or 'Unknown' if the ticker is not in the table."""
+    if metadata is None or ticker not in metadata.index:
+        return unknown_sector
+    return metadata.at[ticker, 'Sector']
+
+def map_sectors(metadata: pd.DataFrame, tickers) -> pd.Series:
+    """Sectors for many tickers at once, indexed by ticker."""
+    tickers = pd.Index(tickers)
+    if metadata is None or metadata.empty:
+        return pd.Series(unknown_sector, index=tickers, dtype='object')
+    return metadata['Sector'].reindex(tickers).astype('object').fillna(unknown_sector)
+
+def sector_exposure(metadata: pd.DataFrame, values: pd.Series) -> pd.Series:
+    """Sums a ticker-indexed Series (e.g. position values) per sector."""
+    if values.empty:
+        return pd.Series(dtype=float)
+    return values.groupby(map_sectors(metadata, values.index)).sum().sort_values(ascending=False)
@@ -2,6 +2,9 @@ import pandas as pd
 import numpy as np
 from portfolio import Portfolio
 from utils import get_time_interval
+from holdings import holdings_history
+from returnscache import returns_cache
+from pricecube import has_ticker, get_price, get_latest_price, get_series
 from collections import defaultdict, deque
 import scipy.stats as stats
 
@@ -19,17 +22,13 @@ def portfolio_pnl(portfolio, start_date=None, end_date=None) -> tuple[float]:
         tuple: (realised_pnl, unrealised_pnl) floats
     """
     prices = portfolio.data
-    start,end = get_time_interval(prices, start_date, end_date, verify_date=portfolio.verify_date)
+    start,end = get_time_interval(prices, start_date, end_date, calendar=portfolio.calendar)
     realised_pnl = 0.0
     unrealised_pnl = 0.0
     inventory = defaultdict(deque) #fifo
     
-    log_df = pd.DataFrame(portfolio.log) if isinstance(portfolio.log, list) else portfolio.log
+    log_df = portfolio.log.between(start, end) #datoindeks i loggen, ingen gennemløb af hele loggen
     for log in log_df.itertuples():
-        log_date = pd.to_datetime(log.Date)
-        if not (start <= log_date <= end):
-            continue
-        
         ticker = log.Ticker
         quantity = log.Quantity
         price = log.Price
@@ -61,7 +60,7 @@ def portfolio_pnl(portfolio, start_date=None, end_date=None) -> tuple[float]:
             raise ValueError(f"Transaction type '{log.Type}' not implemented.")
         
     for ticker, lots in inventory.items():
-        current_price = prices.loc[end, (ticker, 'Close')]
+        current_price = get_price(prices, end, ticker)
     for quantity, cost in lots:
         unrealised_pnl += quantity * (current_price - cost)
 
@@ -85,9 +84,9 @@ def simple_historical_var(portfolio, confidence_level=0.95, lookback_days=100) -
 
         returns = []
         for ticker, quantity in portfolio.assets.items():
-            if (ticker, 'Close') not in portfolio.data.columns:
+            if not has_ticker(portfolio.data, ticker):
                 continue
-            price_series = portfolio.data[(ticker, 'Close')].dropna()
+            price_series = get_series(portfolio.data, ticker).dropna()
             daily_returns = price_series.pct_change().dropna()
             weighted_returns = daily_returns[-lookback_days:] * quantity * price_series.iloc[-1]
             returns.append(weighted_returns)
@@ -116,22 +115,16 @@ def portfolio_returns(portfolio, start_date=None, end_date=None):
     Convert multi-index DataFrame to a Series of returns.
     
     Parameters:
-        data (pd.DataFrame): MultiIndex (ticker, feature) with 'Close' prices.
+        portfolio (Portfolio): Portfolio whose data is a MultiIndex (ticker, feature) DataFrame or a PriceCube.
         
     Returns:
         pd.Series: Returns of the portfolio.
     """
-    data = portfolio.data.copy()
-
-    if start_date:
-        data = data.loc[data.index >= pd.to_datetime(start_date)]
-    if end_date:
-       data = data.loc[data.index <= pd.to_datetime(end_date)]
-
-    close_prices = data.xs('Close', level=1, axis=1)
-    daily_returns = close_prices.pct_change().dropna()
+    # Kun de tickers der ejes, fra den delte cache
+    valid_tickers = [ticker for ticker in portfolio.assets if has_ticker(portfolio.data, ticker)]
+    daily_returns = returns_cache.returns(portfolio.data, valid_tickers, start_date, end_date).dropna()
 
-    current_prices = {ticker: portfolio.data[(ticker, 'Close')].iloc[-1] 
+    current_prices = {ticker: get_latest_price(portfolio.data, ticker) 
                      for ticker in portfolio.assets}
     weights = {ticker: portfolio.assets[ticker] * current_prices[ticker] 
               for ticker in portfolio.assets}
@@ -143,8 +136,6 @@ def portfolio_returns(portfolio, start_date=None, end_date=None):
     # Normalisér weights
     weights = {t: w/total_value for t, w in weights.items()}
     
-    # Match med deres respektive tickers
-    valid_tickers = [t for t in weights.keys() if t in daily_returns.columns]
     if not valid_tickers:
         return pd.Series(dtype=float)
     
@@ -175,3 +166,11 @@ def portfolio_return_float(portfolio, start_date=None, end_date=None):
     return cum_return
 
 
+
+
+def portfolio_nav_returns(portfolio, start_date=None, end_date=None) -> pd.Series:
+    """
+    Daily returns of the portfolio's actual NAV, with holdings and cash changing over time as in the log.
+    Unlike portfolio_returns, which weights today's holdings over the whole period.
+    """
+    return holdings_history(portfolio, start_date, end_date).returns()
@@ -4,48 +4,71 @@ from statsmodels.tools.tools import add_constant
 from statsmodels.tsa.stattools import coint
 import pandas as pd
 import numpy as np
+from pricecube import get_field_frame, has_ticker
+from cointegration import coint_pvalues, prescreen_pairs
+from metadata import metadata_from_frame, map_sectors
+from signals import hysteresis_positions
 
 
-def find_cointegrated_pairs(data, tickers, significance=0.05):
+def find_cointegrated_pairs(data, tickers, significance=0.05, pairs=None, batch_size=128, prescreen=None, metadata=None,
+                            return_funnel=False, cache=None):
     """Find cointegrated pairs in a list of time series data.
+    The close prices are aligned in one matrix and all pairs are tested with the batched Engle-Granger test
+    in cointegration.coint_pvalues, which gives the same p-values as test_cointegration pair by pair.
     Args:
-        data (list): List of time series data
-        tickers (list): List of tickers O(n^2) tidskompleksitet
+        data (pd.DataFrame or PriceCube): Price data with a 'Close' field per ticker
+        tickers (list): List of tickers, every pair i < j is tested unless pairs is given
         significance (float, optional): Significance level for cointegration. Defaults to 0.05.
+        pairs (tuple of arrays, optional): (i, j) index arrays into tickers of the pairs to test, tickers[i] is regressed on tickers[j].
+        batch_size (int, optional): Pairs tested per batch, see coint_pvalues.
+        prescreen (dict, optional): Options for cointegration.prescreen_pairs, e.g. {'same_sector': True, 'top_n': 2000},
+            so only the most similar pairs are tested.
+        metadata (pd.DataFrame, optional): Metadata table with the sectors for same_sector. Defaults to the sectors in data.
+        return_funnel (bool, optional): Also return a dict with the number of pairs left after each stage.
+            With a cache, 'cached' counts the pairs read from the cache and 'tested' the pairs that were tested.
+        cache (CointegrationCache, optional): Reuses the p-values of pairs whose prices did not change since they were
+            tested, and saves the new results. See cointcache.CointegrationCache.
     """
-    
-    if len(tickers) > 80:
-        raise ValueError("Dont. 80 tickers is reasonable maximum due to time complexity")
-        
-    n = len(tickers) 
-    pairs = []
-    for i in range(n):
-        for j in range(i+1, n):
-            t1, t2 = tickers[i], tickers[j]
-            s1 = data[(t1, 'Close')]
-            s2 = data[(t2, 'Close')]
-            
-            all_common_idx = s1.index.intersection(s2.index)
-            s1_common = s1.loc[all_common_idx]
-            s2_common = s2.loc[all_common_idx]
-            
-            # Fjerner de SAMME datoer fra begge serier. forhåbentlig sikrer at det ikke er misaligned
-            mask = (~s1_common.isna()) & (~s2_common.isna()) & (~np.isinf(s1_common)) & (~np.isinf(s2_common))
-            s1_clean = s1_common[mask]  
-            s2_clean = s2_common[mask]
-            
-            if len(s1_clean) < 100:  # skip hvis ikke nok overlap
-                continue
-            if s1_clean.iloc[0] == 0 or s2_clean.iloc[0] == 0:
-                continue  # Skip hvis prisen er 0
-            
-            s1_norm = s1_clean / s1_clean.iloc[0]
-            s2_norm = s2_clean / s2_clean.iloc[0]
-            
-            pvalue = test_cointegration(s1_norm, s2_norm)
-            if pvalue < significance:
-                pairs.append((t1, t2, pvalue))
-    return sorted(pairs, key=lambda x: x[2]) #sortere efter p-værdi (key = p-værdi) eksempel: ('AAPL', 'MSFT', 0.01) laveste p-værdi først
+    tickers = list(tickers)
+    check_tickers(data, tickers)
+    close_frame = get_field_frame(data, 'Close').reindex(columns=pd.Index(tickers))
+    close = close_frame.to_numpy(dtype=float)
+    first, second, funnel = candidate_pairs(data, tickers, close, pairs, prescreen, metadata)
+
+    if cache is None:
+        pvalues = coint_pvalues(close, first, second, batch_size=batch_size) #NaN for par med for lidt overlap eller pris 0
+    else:
+        tested = cache.stats['tested']
+        pvalues = cache.pvalues(close, close_frame.index, tickers, first, second, batch_size=batch_size)
+        tested = cache.stats['tested'] - tested #kun de par der faktisk blev sendt til coint_pvalues
+        funnel.update(cached=len(first) - tested, tested=tested)
+        cache.save()
+    found = np.flatnonzero(pvalues < significance)
+    found = found[np.argsort(pvalues[found], kind='stable')]
+    result = [(tickers[first[k]], tickers[second[k]], float(pvalues[k])) for k in found] #sorteret efter p-værdi, eksempel: ('AAPL', 'MSFT', 0.01) laveste p-værdi først
+    if return_funnel:
+        if cache is None:
+            funnel['tested'] = int(np.isfinite(pvalues).sum())
+        funnel['cointegrated'] = len(result)
+        return result, funnel
+    return result
+
+def check_tickers(data, tickers) -> None:
+    """Raises KeyError for tickers that are not in data, instead of testing them as all-NaN columns."""
+    missing = [ticker for ticker in tickers if not has_ticker(data, ticker)]
+    if missing:
+        raise KeyError(f"Ticker not found in data: {', '.join(map(str, missing))}")
+
+def candidate_pairs(data, tickers, close, pairs=None, prescreen=None, metadata=None):
+    """(i, j) index arrays of the pairs to test, all i < j unless pairs is given, filtered by prescreen_pairs if prescreen is given."""
+    if pairs is None:
+        first, second = np.triu_indices(len(tickers), k=1)
+    else:
+        first, second = (np.asarray(index, dtype=np.int64) for index in pairs)
+    if prescreen is None:
+        return first, second, {'candidates': len(first)}
+    metadata = metadata if metadata is not None else metadata_from_frame(data)
+    return prescreen_pairs(close, first, second, sectors=map_sectors(metadata, tickers).to_numpy(), **prescreen)
 
 
 def test_cointegration(series1, series2) -> float:
@@ -107,49 +130,15 @@ def generate_pairs_trading_signals(series1, series2, beta, zscore, z_entry=2.0,
     series1 = series1.loc[common_idx]
     series2 = series2.loc[common_idx]
     
+    # Positioner fra z-score med den vektoriserede hysterese, se signals.hysteresis_positions
+    state = hysteresis_positions(zscore.to_numpy(dtype=float), z_entry, z_exit)
     tradesignal = pd.DataFrame(index=zscore.index)
     tradesignal['zscore'] = zscore.astype(float)
-    tradesignal['signal'] = 0
-    tradesignal['pos1'] = 0.0
-    tradesignal['pos2'] = 0.0
+    tradesignal['signal'] = state.astype(np.int64)
+    tradesignal['pos1'] = state.astype(float)
+    tradesignal['pos2'] = np.where(state != 0, -float(beta) * state, 0.0)
     tradesignal['returns'] = 0.0
     tradesignal['daily_returns'] = 0.0
-    in_long = False
-    in_short = False
-    
-    for i in range(len(tradesignal)):
-        current_zscore = zscore.iloc[i]
-        if not in_long and not in_short:
-            if current_zscore < -z_entry:
-                in_long = True
-                tradesignal.iloc[i, tradesignal.columns.get_loc('signal')] = 1
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos1')] = 1.0
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos2')] = -float(beta)
-            elif current_zscore > z_entry:
-                in_short = True
-                tradesignal.iloc[i, tradesignal.columns.get_loc('signal')] = -1
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos1')] = -1.0
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos2')] = float(beta)
-        elif in_long:
-            if abs(current_zscore) < z_exit:
-                in_long = False
-                tradesignal.iloc[i, tradesignal.columns.get_loc('signal')] = 0
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos1')] = 0
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos2')] = 0
-            else:
-                tradesignal.iloc[i, tradesignal.columns.get_loc('signal')] = 1
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos1')] = 1.0
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos2')] = -float(beta)
-        elif in_short:
-            if abs(current_zscore) < z_exit:
-                in_short = False
-                tradesignal.iloc[i, tradesignal.columns.get_loc('signal')] = 0
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos1')] = 0
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos2')] = 0
-            else:
-                tradesignal.iloc[i, tradesignal.columns.get_loc('signal')] = -1
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos1')] = -1.0
-                tradesignal.iloc[i, tradesignal.columns.get_loc('pos2')] = float(beta)
 
     # Beregn afkast brug close-to-close returns
     ret1 = series1.pct_change().fillna(0)
@@ -165,3 +154,43 @@ def generate_pairs_trading_signals(series1, series2, beta, zscore, z_entry=2.0,
     
     return tradesignal
 
+
+
+def generate_pairs_trading_signals_batch(prices1: pd.DataFrame, prices2: pd.DataFrame, betas, zscores: pd.DataFrame,
+                                         z_entry=2.0, z_exit=0.5) -> dict:
+    """
+    generate_pairs_trading_signals for many pairs in one call. The positions of all pairs come from one
+    hysteresis pass over the dates x pairs z-score matrix, and the returns are computed as matrices.
+
+    Args:
+        prices1, prices2 (pd.DataFrame): Dates x pairs prices of the first and second leg, same shape and labels as zscores
+        betas (sequence): Hedge ratio per pair
+        zscores (pd.DataFrame): Dates x pairs z-scores of the spreads
+
+    Returns:
+        dict: pair column -> tradesignal DataFrame, like generate_pairs_trading_signals
+    """
+    prices1 = prices1.reindex(index=zscores.index, columns=zscores.columns)
+    prices2 = prices2.reindex(index=zscores.index, columns=zscores.columns)
+    betas = np.asarray(betas, dtype=float)
+    state = hysteresis_positions(zscores.to_numpy(dtype=float), z_entry, z_exit)
+    pos1 = state.astype(float)
+    pos2 = np.where(state != 0, -betas * state, 0.0)
+
+    ret1 = prices1.pct_change().fillna(0).to_numpy()
+    ret2 = prices2.pct_change().fillna(0).to_numpy()
+    daily_returns = np.vstack([np.zeros((1, state.shape[1])), pos1[:-1] * ret1[1:] + pos2[:-1] * ret2[1:]])
+    cumulative_returns = np.cumprod(1 + daily_returns, axis=0) - 1
+
+    results = {}
+    for j, pair in enumerate(zscores.columns):
+        tradesignal = pd.DataFrame(index=zscores.index)
+        tradesignal['zscore'] = zscores.iloc[:, j].astype(float)
+        tradesignal['signal'] = state[:, j].astype(np.int64)
+        tradesignal['pos1'] = pos1[:, j]
+        tradesignal['pos2'] = pos2[:, j]
+        tradesignal['returns'] = daily_returns[:, j]
+        tradesignal['daily_returns'] = 0.0
+        tradesignal['comulative_returns'] = cumulative_returns[:, j]
+        results[pair] = tradesignal
+    return results
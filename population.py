@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from pricecube import get_tickers, get_field_frame
+from tradingcalendar import get_calendar
+
+annual_factor = 251 #samme antal handelsdage som RiskMetrics
+
+
+def _draw_chunk(rng, n, n_tickers, num_assets, max_shares, lo, hi):
+    """Draws tickers (without replacement, in random order), quantities and buy date positions for n portfolios."""
+    keys = rng.random((n, n_tickers))
+    tickers = np.argpartition(keys, num_assets - 1, axis=1)[:, :num_assets]
+    order = np.argsort(np.take_along_axis(keys, tickers, axis=1), axis=1) #tilfældig rækkefølge, den bestemmer hvilke køb der afvises
+    tickers = np.take_along_axis(tickers, order, axis=1)
+    quantities = rng.integers(1, max_shares + 1, size=(n, num_assets))
+    positions = rng.integers(lo, hi, size=(n, num_assets))
+    return tickers, quantities, positions
+
+
+def _score_chunk(close, tickers, quantities, positions, starting_cash, lo, value_pos):
+    """
+    Buys every portfolio of the chunk in asset order with a cash check, and computes the daily NAV of all of them
+    from lo to value_pos as one (days x portfolios) matrix.
+    """
+    n, num_assets = tickers.shape
+    prices = close[positions, tickers]
+    costs = prices * quantities
+    cash = np.full(n, float(starting_cash))
+    filled = np.zeros((n, num_assets), dtype=bool)
+    for j in range(num_assets): #køb sker i rækkefølge, så et køb kan afvises fordi de tidligere brugte kontanterne
+        ok = np.isfinite(costs[:, j]) & (costs[:, j] <= cash)
+        cash -= np.where(ok, costs[:, j], 0.0)
+        filled[:, j] = ok
+
+    # NAV[t] = startkontanter + sum over købte aktiver af (værdi - købspris) fra købsdagen
+    window = close[lo:value_pos + 1]
+    days = np.arange(lo, value_pos + 1)[:, None]
+    nav = np.full((len(window), n), float(starting_cash))
+    for j in range(num_assets):
+        held = filled[:, j] & (days >= positions[:, j])
+        nav += np.where(held, window[:, tickers[:, j]] * quantities[:, j] - costs[:, j], 0.0)
+    return filled, cash, nav
+
+
+def _nav_scores(nav, risk_free_rate):
+    """Risk and return of every NAV column, with the same definitions as RiskMetrics."""
+    returns = nav[1:] / nav[:-1] - 1
+    n_days = len(returns)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        annualized_return = (nav[-1] / nav[0]) ** (annual_factor / n_days) - 1 if n_days else np.full(nav.shape[1], np.nan)
+        annualized_volatility = returns.std(axis=0, ddof=1) * np.sqrt(annual_factor) if n_days > 1 else np.full(nav.shape[1], np.nan)
+        sharpe_ratio = (annualized_return - risk_free_rate) / annualized_volatility
+        max_drawdown = (nav / np.maximum.accumulate(nav, axis=0) - 1).min(axis=0)
+        var_95 = -np.percentile(returns, 5, axis=0) if n_days else np.full(nav.shape[1], np.nan)
+    return annualized_return, annualized_volatility, sharpe_ratio, max_drawdown, var_95
+
+
+def random_population(data, n_portfolios, num_assets=30, max_shares=200, start_date=None, end_date=None,
+                      starting_cash=100000, value_date=None, risk_free_rate=0.0, seed=None, chunk_size=1000) -> pd.DataFrame:
+    """
+    Draws and scores many random portfolios at once, without creating Portfolio objects.
+    Every portfolio is built like Portfolio.generate_random_portfolio: num_assets different tickers, each bought
+    once at the close of a random trading day between start_date and end_date with 1 to max_shares shares,
+    in random order and only if there is cash enough. Buys without a price are rejected.
+    The portfolios are drawn in chunks of chunk_size, each chunk with its own numpy Generator spawned from seed,
+    so the result is reproducible for a given seed and chunk_size.
+
+    Args:
+        data (pd.DataFrame or PriceCube): Price data from load_data
+        n_portfolios (int): Number of portfolios
+        num_assets (int, optional): Tickers per portfolio. Defaults to 30.
+        max_shares (int, optional): Max shares per buy. Defaults to 200.
+        start_date, end_date (str, optional): Range of the buy dates. Defaults to all of data.
+        starting_cash (float, optional): Cash of every portfolio before buying. Defaults to 100000.
+        value_date (str, optional): Date the portfolios are valued at, defaults to the last date in data.
+            Must not be before the last possible buy date.
+        risk_free_rate (float, optional): Annual risk-free rate for the Sharpe ratio. Defaults to 0.
+        seed (int or np.random.SeedSequence, optional): Seed of the random streams.
+        chunk_size (int, optional): Portfolios per chunk, bounds the memory used for the NAV matrices. Defaults to 1000.
+
+    Returns:
+        pd.DataFrame: One row per portfolio with Positions, Rejected, Invested, Cash, Value, Total Return and the risk
+            metrics of its daily NAV from start_date to value_date (Annualized Return, Annualized Volatility,
+            Sharpe Ratio, Max Drawdown, 95% VaR).
+    """
+    calendar = get_calendar(data)
+    lo, hi = calendar.slice_positions(start_date, end_date)
+    if hi <= lo:
+        raise ValueError("No trading days between start_date and end_date.")
+    value_pos = len(calendar) - 1 if value_date is None else calendar.previous_position(value_date)
+    if value_pos < hi - 1:
+        raise ValueError("value_date must not be before end_date.")
+
+    tickers = get_tickers(data)
+    num_assets = min(num_assets, len(tickers))
+    #lukkekurser som en dates x tickers matrix, fremadfyldt så en position altid har en kurs efter købet
+    close = get_field_frame(data, 'Close').reindex(columns=tickers).ffill().to_numpy(dtype=float)
+
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    n_chunks = -(-n_portfolios // chunk_size)
+    columns = {name: [] for name in ['Positions', 'Rejected', 'Invested', 'Cash', 'Value', 'Annualized Return',
+                                     'Annualized Volatility', 'Sharpe Ratio', 'Max Drawdown', '95% VaR']}
+    for chunk, child in enumerate(seed_sequence.spawn(n_chunks)):
+        n = min(chunk_size, n_portfolios - chunk * chunk_size)
+        rng = np.random.default_rng(child)
+        chunk_tickers, quantities, positions = _draw_chunk(rng, n, len(tickers), num_assets, max_shares, lo, hi)
+        filled, cash, nav = _score_chunk(close, chunk_tickers, quantities, positions, starting_cash, lo, value_pos)
+        annualized_return, annualized_volatility, sharpe_ratio, max_drawdown, var_95 = _nav_scores(nav, risk_free_rate)
+
+        columns['Positions'].append(filled.sum(axis=1).astype(np.int32))
+        columns['Rejected'].append((~filled).sum(axis=1).astype(np.int32))
+        columns['Invested'].append(starting_cash - cash)
+        columns['Cash'].append(cash)
+        columns['Value'].append(nav[-1])
+        columns['Annualized Return'].append(annualized_return)
+        columns['Annualized Volatility'].append(annualized_volatility)
+        columns['Sharpe Ratio'].append(sharpe_ratio)
+        columns['Max Drawdown'].append(max_drawdown)
+        columns['95% VaR'].append(var_95)
+
+    results = pd.DataFrame({name: np.concatenate(values) if values else np.empty(0) for name, values in columns.items()})
+    results.insert(5, 'Total Return', results['Value'] / starting_cash - 1)
+    results.index.name = 'Portfolio'
+    return results
@@ -1,16 +1,126 @@
+import copy
 import pandas as pd
 import numpy as np
 from riskmetrics import RiskMetrics
+from metadata import metadata_from_frame, get_sector, sector_exposure
+from pricecube import get_tickers, has_ticker, get_price_at, get_prices_at
+from returnscache import returns_cache
+from tradingcalendar import TradingCalendar
+from txlog import TransactionLog
+from events import EventSink, NullSink
+
+price_cache_size = 256 #antal valueringsdatoer der holdes prisvektorer for
+
+
+class PortfolioSnapshot:
+    """
+    Frozen state of a Portfolio: cash, holdings and transaction log, taken with Portfolio.snapshot().
+    Shares its holdings and log with the portfolio it was taken from, nothing is copied until one of them changes.
+    """
+    def __init__(self, data, cash, assets, positions, holdings_value, unpriced, log):
+        self.data = data
+        self.cash = cash
+        self.assets = assets
+        self.positions = positions
+        self.holdings_value = holdings_value
+        self.unpriced = unpriced
+        self.log = log
+
+    def __repr__(self):
+        return f"PortfolioSnapshot(cash={self.cash:.2f}, holdings={len(self.assets)}, log={len(self.log)})"
 
 
 class Portfolio:
-    def __init__(self, name, data, starting_cash=100000):
+    def __init__(self, name, data, starting_cash=100000, metadata=None, sink: EventSink = None):
         self.name = name
         self.starting_cash = starting_cash
         self.current_cash = starting_cash
-        self.data = data
+        #statisk data som sektorer, se download_data.load_metadata
+        self.metadata = metadata if metadata is not None else metadata_from_frame(data)
         self.assets = {}
-        self.log = []
+        self.log = TransactionLog()
+        #diagnostik går til en sink, default er ingenting. Brug PrintSink() for at få beskederne i terminalen
+        self.sink = sink if sink is not None else NullSink()
+        self._holdings_shared = False #assets, _positions og _unpriced deles med et snapshot eller en fork
+        self._set_data(data)
+
+    def _set_data(self, data):
+        """
+        Sets the price data and rebuilds everything derived from it: the trading calendar, the ticker index,
+        the holdings vector aligned to it and the cached price vectors used for valuation.
+        """
+        self.data = data
+        self.calendar = TradingCalendar(data.index)
+        self._tickers = pd.Index(get_tickers(data))
+        self._ticker_index = {ticker: i for i, ticker in enumerate(self._tickers)}
+        self._positions = np.zeros(len(self._tickers))
+        for ticker, quantity in self.assets.items():
+            self._positions[self._ticker_index[ticker]] = quantity
+        self._price_rows = {}
+        self._revalue()
+
+    def _prices_at(self, position: int, idx: np.ndarray) -> np.ndarray:
+        """
+        Close prices at a date position for the tickers at idx in the ticker index.
+        Each date has a price vector aligned to the ticker index that is filled in as tickers are asked for,
+        so a price is looked up in the data at most once per date.
+        """
+        cached = self._price_rows.get(position)
+        if cached is None:
+            if len(self._price_rows) >= price_cache_size:
+                self._price_rows.clear()
+            cached = self._price_rows[position] = (np.full(len(self._tickers), np.nan), np.zeros(len(self._tickers), dtype=bool))
+        prices, loaded = cached
+        missing = idx[~loaded[idx]]
+        if len(missing):
+            prices[missing] = get_prices_at(self.data, np.full(len(missing), position), self._tickers[missing], ['Close'] * len(missing))
+            loaded[missing] = True
+        return prices[idx]
+
+    def _held_index(self) -> np.ndarray:
+        """Positions of the current holdings in the ticker index."""
+        return np.fromiter((self._ticker_index[ticker] for ticker in self.assets), dtype=np.int64, count=len(self.assets))
+
+    def _revalue(self):
+        """Recomputes the market value of the holdings at the last close from scratch, one dot product."""
+        idx = self._held_index()
+        prices = self._prices_at(len(self.calendar) - 1, idx) if len(self.calendar) else np.full(len(idx), np.nan)
+        priced = np.isfinite(prices)
+        self._holdings_value = float(np.dot(self._positions[idx[priced]], prices[priced]))
+        self._unpriced = {self._tickers[i] for i in idx[~priced]} #beholdninger uden sidste kurs gør værdien NaN
+
+    def _own_holdings(self):
+        """Copies the holdings before they are changed, if they are shared with a snapshot or a fork."""
+        if self._holdings_shared:
+            self.assets = dict(self.assets)
+            self._positions = self._positions.copy()
+            self._unpriced = set(self._unpriced)
+            self._holdings_shared = False
+
+    def _apply_fill(self, ticker, quantity):
+        """
+        Adds quantity (negative for sales) to a holding and updates the holdings vector
+        and the market value incrementally with the last close of the ticker.
+        """
+        self._own_holdings()
+        i = self._ticker_index[ticker]
+        holding = self.assets.get(ticker, 0) + quantity
+        if holding == 0:
+            self.assets.pop(ticker, None)
+        else:
+            self.assets[ticker] = holding
+        self._positions[i] = holding
+
+        price = self._prices_at(len(self.calendar) - 1, np.array([i]))[0]
+        if not np.isfinite(price):
+            if holding == 0:
+                self._unpriced.discard(ticker)
+            else:
+                self._unpriced.add(ticker)
+        elif self.assets:
+            self._holdings_value += quantity * price
+        else:
+            self._holdings_value = 0.0 #ingen beholdninger, nulstil så afrundingsfejl ikke hober sig op
         
     def __str__(self):
         """
@@ -20,10 +130,7 @@ class Portfolio:
         
 
         for ticker in self.assets:
-            try:
-                sector = self.data[(ticker, 'Sector')].dropna().iloc[0] if 'Sector' in self.data[ticker] else 'Unknown'
-            except:
-                sector = 'Unknown'
+            sector = get_sector(self.metadata, ticker)
             shares = self.assets[ticker]
             output.append(f"{ticker} - Sector: {sector}, Shares: {shares}")
 
@@ -44,24 +151,24 @@ class Portfolio:
             at_date (str, optional): Date to buy the asset. If None, uses the last date in data.
             open (bool, optional): If True, buys at the open price of the day. Defaults to False, which buys at close price.
         """
-        verified_date = self.verify_date(at_date)
+        verified_date, position = self._resolve_date(at_date)
         
         if open: #Hvis open er True, bruges åbningskursen
-            price = self.data.loc[verified_date, (ticker, 'Open')]
+            price = get_price_at(self.data, position, ticker, 'Open')
         else: #Hvis open er False, bruges lukkeprisen
-            price = self.data.loc[verified_date, (ticker, 'Close')]
+            price = get_price_at(self.data, position, ticker, 'Close')
         total_cost = price * quantity
         if total_cost > self.current_cash:
-            print(f"Not enough cash to buy {quantity} shares of {ticker}.")
+            self.sink.emit('buy_rejected', ticker=ticker, quantity=quantity, price=price, cash=self.current_cash)
             return
         self.current_cash -= total_cost
-        self.assets[ticker] = self.assets.get(ticker, 0) + quantity 
+        self._apply_fill(ticker, quantity)
         
         # Log handlen
         self.log_transaction('Buy', verified_date, ticker, quantity, price, total_cost)
 
         
-        print(f"Bought {quantity} shares of {ticker}, at {price} per share. Current holdings: {self.assets[ticker]} shares.")
+        self.sink.emit('buy', ticker=ticker, quantity=quantity, price=price, date=verified_date, holdings=self.assets[ticker])
         
     def sell_asset(self, ticker, quantity:int, at_date=None, open=False):
         """_summary_
@@ -73,27 +180,114 @@ class Portfolio:
             open (bool, optional): If True, sells at the open price of the day. Defaults to False, which sells at close price.
         """
         if ticker not in self.assets or self.assets[ticker] < quantity:
-            print(f"Not enough shares of {ticker} to sell.")
+            self.sink.emit('sell_rejected', ticker=ticker, quantity=quantity, holdings=self.assets.get(ticker, 0))
             return
         
-        verified_date = self.verify_date(at_date)
+        verified_date, position = self._resolve_date(at_date)
             
         if open: #Hvis open er True, bruges åbningskursen
-            price = self.data.loc[verified_date, (ticker, 'Open')]
+            price = get_price_at(self.data, position, ticker, 'Open')
         else: #Hvis open er False, bruges lukkeprisen
-            price = self.data.loc[verified_date, (ticker, 'Close')]
+            price = get_price_at(self.data, position, ticker, 'Close')
             
         total_revenue = price * quantity
         self.current_cash += total_revenue
-        self.assets[ticker] -= quantity
+        self._apply_fill(ticker, -quantity)
         
         # Log handlen
         self.log_transaction('Sell', verified_date, ticker, quantity, price, total_revenue)
         
         
-        print(f"Sold {quantity} shares of {ticker}, at {price} per share. Remaining holdings: {self.assets.get(ticker, 0)} shares.")
-        if self.assets[ticker] == 0:
-            del self.assets[ticker]
+        self.sink.emit('sell', ticker=ticker, quantity=quantity, price=price, date=verified_date, holdings=self.assets.get(ticker, 0))
+        
+    def execute_orders(self, orders) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Executes many orders in one pass. Dates and prices are resolved with one vectorized lookup,
+        cash and holdings are checked in the order given, and all fills are logged in bulk.
+
+        Args:
+            orders (pd.DataFrame or list of dicts): One row per order with columns
+                ticker, quantity, side ('buy' or 'sell'), and optionally date (None = last date in data)
+                and open (True = trade at the open price, default close).
+
+        Returns:
+            tuple: (fills, rejections) DataFrames. fills has order, ticker, side, date, quantity, price, total,
+                rejections has order, ticker, side, quantity, reason. order is the row number in orders.
+        """
+        orders = pd.DataFrame(orders)
+        n = len(orders)
+        tickers = orders['ticker'].tolist() if n else []
+        quantity_values = orders['quantity'].tolist() if n else []
+        quantities = np.asarray(quantity_values, dtype=float)
+        sides = orders['side'].str.lower().tolist() if n else []
+        opens = orders['open'].fillna(False).astype(bool).tolist() if 'open' in orders else [False] * n
+
+        # Datoer -> positioner i kalenderen, manglende dato = sidste dag
+        positions = np.full(n, len(self.calendar) - 1, dtype=np.int64)
+        if 'date' in orders and n:
+            dates = pd.to_datetime(orders['date'])
+            given = dates.notna().to_numpy()
+            positions[given] = self.calendar.index.searchsorted(pd.DatetimeIndex(dates[given]), side='left')
+        valid_date = positions < len(self.calendar)
+
+        fields = ['Open' if o else 'Close' for o in opens]
+        prices = np.full(n, np.nan)
+        prices[valid_date] = get_prices_at(self.data, positions[valid_date],
+                                           [t for t, ok in zip(tickers, valid_date) if ok],
+                                           [f for f, ok in zip(fields, valid_date) if ok])
+
+        known = {(t, f): has_ticker(self.data, t, f) for t, f in set(zip(tickers, fields))}
+
+        fill_rows, rejections = [], []
+        cash = self.current_cash
+        for i in range(n):
+            ticker, quantity, side, price = tickers[i], quantity_values[i], sides[i], prices[i]
+            if side not in ('buy', 'sell'):
+                reason = f"invalid side '{side}'"
+            elif not quantity > 0:
+                reason = "quantity must be positive"
+            elif not known[(ticker, fields[i])]:
+                reason = "unknown ticker"
+            elif not valid_date[i]:
+                reason = "no valid date"
+            elif not np.isfinite(price):
+                reason = "no price"
+            elif side == 'buy' and price * quantity > cash:
+                reason = "not enough cash"
+            elif side == 'sell' and self.assets.get(ticker, 0) < quantity:
+                reason = "not enough shares"
+            else:
+                reason = None
+            if reason is not None:
+                rejections.append((i, ticker, side, quantity, reason))
+                continue
+
+            total = price * quantity
+            if side == 'buy':
+                cash -= total
+                self._apply_fill(ticker, quantity)
+            else:
+                cash += total
+                self._apply_fill(ticker, -quantity)
+            fill_rows.append(i)
+        self.current_cash = cash
+
+        fill_rows = np.asarray(fill_rows, dtype=np.int64)
+        fill_sides = [sides[i] for i in fill_rows]
+        fill_totals = prices[fill_rows] * quantities[fill_rows]
+        fill_totals = np.where([side == 'buy' for side in fill_sides], -np.abs(fill_totals), np.abs(fill_totals))
+        fill_dates = self.calendar.index[positions[fill_rows]]
+        fill_tickers = [tickers[i] for i in fill_rows]
+        self.log.extend(['Buy' if side == 'buy' else 'Sell' for side in fill_sides], fill_dates, fill_tickers,
+                        quantities[fill_rows], prices[fill_rows], fill_totals)
+
+        fills = pd.DataFrame({
+            'order': fill_rows, 'ticker': fill_tickers, 'side': fill_sides, 'date': fill_dates,
+            'quantity': quantities[fill_rows], 'price': prices[fill_rows], 'total': fill_totals
+        })
+        rejections = pd.DataFrame(rejections, columns=['order', 'ticker', 'side', 'quantity', 'reason'])
+        self.sink.emit('orders_executed', fills=len(fills), rejections=len(rejections))
+        return fills, rejections
         
     def log_transaction(self, type_:str, date, ticker, quantity:int, price:float, total):
         if type_ == 'Buy':
@@ -101,18 +295,11 @@ class Portfolio:
         if type_ =='Sell':
             total = abs(total) #altid positvt
 
-        self.log.append({
-            'Type': type_,
-            'Date': date,
-            'Ticker': ticker,
-            'Quantity': quantity,
-            'Price': price,
-            'Total': total
-        })
+        self.log.append(type_, date, ticker, quantity, price, total)
         
     def get_portfolio_log(self):
-        """Returns the transaction log of the portfolio."""
-        return pd.DataFrame(self.log)
+        """Returns the transaction log of the portfolio. The frame is cached until the next transaction, treat it as read-only."""
+        return self.log.to_frame()
     
     def print_portfolio_log(self, n=5):
         log = self.get_portfolio_log()
@@ -120,25 +307,45 @@ class Portfolio:
         
     def verify_date(self, date) -> pd.Timestamp:
         """Checks if the given date is in the data index, if not, returns the next available date."""
-        if date not in self.data.index:
-            print(f"Date {date} not found in data.")
-            next_dates = self.data.index[self.data.index > date]
-            if len(next_dates) == 0:
-                print(f"No future dates available in data after {date}.")
-                raise ValueError("No valid date found.")
-            date = next_dates[0]
-            print(f"Using next available date: {date.date()}")
-        return date
+        return self._resolve_date(date)[0]
+    
+    def _resolve_date(self, date) -> tuple[pd.Timestamp, int]:
+        """Like verify_date, but also returns the integer position of the date for price lookups."""
+        try:
+            verified_date, position = self.calendar.resolve(date)
+        except ValueError:
+            self.sink.emit('date_not_found', date=date)
+            self.sink.emit('no_future_date', date=date)
+            raise ValueError("No valid date found.")
+        if date is not None and verified_date != pd.Timestamp(date):
+            self.sink.emit('date_not_found', date=date)
+            self.sink.emit('date_adjusted', date=verified_date.date())
+        return verified_date, position
     
         
-    def get_portfolio_value(self) -> float:
-        """Calculates the total value of the portfolio based on current prices."""
-        total_value = self.current_cash
-        for ticker, quantity in self.assets.items():
-            if ticker in self.data.columns.levels[0]:
-                price = self.data[(ticker, 'Close')].iloc[-1]
-                total_value += price * quantity
-        return total_value
+    def get_portfolio_value(self, at_date=None) -> float:
+        """
+        Calculates the total value of the portfolio.
+        Without at_date the holdings are valued at the last close, the value is kept up to date on every trade so this is O(1).
+        With at_date the current holdings are marked to market at the close of the last trading day on or before at_date,
+        which is O(holdings). For the value of the historical holdings on every day, see holdings.holdings_history.
+        """
+        if at_date is None:
+            if self._unpriced:
+                return np.nan
+            return self.current_cash + self._holdings_value
+        idx = self._held_index()
+        prices = self._prices_at(self.calendar.previous_position(at_date), idx)
+        return self.current_cash + float(np.dot(self._positions[idx], prices))
+        
+    def get_sector(self, ticker) -> str:
+        """Returns the sector of a ticker from the metadata table."""
+        return get_sector(self.metadata, ticker)
+    
+    def sector_exposure(self) -> pd.Series:
+        """Returns the current value of the holdings summed per sector."""
+        values = pd.Series({ticker: self.get_asset_value(ticker) for ticker in self.assets}, dtype=float)
+        return sector_exposure(self.metadata, values)
         
     def get_asset_quantity(self, ticker):
         """Returns the quantity of a specific asset in the portfolio."""
@@ -148,12 +355,12 @@ class Portfolio:
         """Returns the current cash available in the portfolio."""
         return self.current_cash
     
-    def get_asset_value(self, ticker):
-        """Returns the value of a specific asset in the portfolio."""
+    def get_asset_value(self, ticker, at_date=None):
+        """Returns the value of a specific asset in the portfolio, at the last close or at the close on or before at_date."""
         if ticker in self.assets:
-            quantity = self.assets[ticker]
-            price = self.data[(ticker, 'Close')].iloc[-1]
-            return quantity * price
+            i = self._ticker_index[ticker]
+            position = len(self.calendar) - 1 if at_date is None else self.calendar.previous_position(at_date)
+            return self._positions[i] * self._prices_at(position, np.array([i]))[0]
         
     def portfolio_returns(self, start_date=None, end_date=None):
         """
@@ -166,25 +373,21 @@ class Portfolio:
         Returns:
             pd.Series: Daily returns of the portfolio
         """
-        # Filtrér
-        data = self.data.copy()
-        if start_date:
-            data = data.loc[data.index >= pd.to_datetime(start_date)]
-        if end_date:
-            data = data.loc[data.index <= pd.to_datetime(end_date)]
-        
-        close_prices = data.xs('Close', level=1, axis=1)
-        daily_returns = close_prices.pct_change().dropna()
-        
+        # Kun de tickers der ejes, fra den delte cache
+        tickers = [ticker for ticker in self.assets if has_ticker(self.data, ticker)]
+        close_prices = returns_cache.close(self.data, tickers, start_date, end_date)
+        daily_returns = returns_cache.returns(self.data, tickers, start_date, end_date).dropna()
         
+        if not tickers: #tom portefølje (eller beholdninger uden data) giver nul-afkast over perioden
+            return pd.Series(0, index=daily_returns.index)
         if daily_returns.empty:
             return pd.Series(dtype=float)
         
         # Beregn nuværende weights baseret på self.assets
-        current_prices = {ticker: data[(ticker, 'Close')].iloc[-1] 
-                        for ticker in self.assets}
+        current_prices = {ticker: close_prices[ticker].iloc[-1] 
+                        for ticker in tickers}
         weights = {ticker: self.assets[ticker] * current_prices[ticker] 
-                for ticker in self.assets}
+                for ticker in tickers}
         total_value = sum(weights.values())
         
         # 
@@ -193,13 +396,11 @@ class Portfolio:
         
         # Normalisér weights
         weights = {t: w/total_value for t, w in weights.items()}
-        # Match med deres respektive tickers
-        valid_tickers = [t for t in weights.keys() if t in daily_returns.columns]
         
         #tag daglige returns enten positive eller negative for hver ticker, og gang dem med deres respektive vægt i porteføljen. ved at tage prikproduktet
-        if valid_tickers:
-            weights_series = pd.Series(weights)[valid_tickers]
-            return daily_returns[valid_tickers].dot(weights_series)
+        if tickers:
+            weights_series = pd.Series(weights)[tickers]
+            return daily_returns[tickers].dot(weights_series)
         else:
             return pd.Series(0, index=daily_returns.index)
     
@@ -208,19 +409,54 @@ class Portfolio:
         """Resets the portfolio to its initial state."""
         self.current_cash = self.starting_cash
         self.assets = {}
-        self.log = []
-        print(f"Portfolio {self.name} has been reset.")    
+        self._positions = np.zeros(len(self._tickers))
+        self._holdings_shared = False
+        self._revalue()
+        self.log = TransactionLog()
+        self.sink.emit('reset', name=self.name)    
+
+    def snapshot(self) -> PortfolioSnapshot:
+        """
+        Takes a snapshot of cash, holdings and log that can be restored later.
+        O(1): the snapshot shares the holdings and log with the portfolio, which copies them before its next change.
+        """
+        self._holdings_shared = True
+        return PortfolioSnapshot(self.data, self.current_cash, self.assets, self._positions,
+                                 self._holdings_value, self._unpriced, self.log.fork())
+
+    def restore(self, snapshot: PortfolioSnapshot):
+        """Sets cash, holdings and log back to a snapshot. The same snapshot can be restored any number of times."""
+        if snapshot.data is not self.data:
+            raise ValueError("Snapshot was taken on different price data.")
+        self.current_cash = snapshot.cash
+        self.assets = snapshot.assets
+        self._positions = snapshot.positions
+        self._holdings_value = snapshot.holdings_value
+        self._unpriced = snapshot.unpriced
+        self._holdings_shared = True
+        self.log = snapshot.log.fork()
+
+    def fork(self, name=None, sink: EventSink = None) -> 'Portfolio':
+        """
+        Returns a new Portfolio branched from the current state, for what-if analysis.
+        The fork shares the market data, calendar, metadata and price caches with this portfolio,
+        and its holdings and log are copy-on-write, so forking is O(1) no matter how big the data or the log is.
+        """
+        clone = copy.copy(self)
+        clone.name = name if name is not None else self.name
+        if sink is not None:
+            clone.sink = sink
+        self._holdings_shared = clone._holdings_shared = True
+        clone.log = self.log.fork()
+        return clone
     
     def generate_random_portfolio(self, num_assets=30, max_shares = 200, start_date=None, end_date=None, random_seed=123):
-        """Generates a random portfolio with a given number of assets."""
-        #Filtrer data og set seed
-        if start_date:
-            self.data = self.data.loc[self.data.index >= pd.to_datetime(start_date)]
-        if end_date:
-            self.data = self.data.loc[self.data.index <= pd.to_datetime(end_date)]
+        """Generates a random portfolio with a given number of assets, bought on random days between start_date and end_date."""
+        #Find datointervallet og set seed. Data filtreres ikke, så den kan deles med snapshots og forks
+        lo, hi = self.calendar.slice_positions(start_date, end_date)
         
         np.random.seed(random_seed)
-        tickers = list(self.data.columns.levels[0])
+        tickers = list(get_tickers(self.data))
         
         
         if num_assets > len(tickers):
@@ -229,7 +465,7 @@ class Portfolio:
         chosen_tickers = np.random.choice(tickers, size=num_assets, replace = False)
         for ticker in chosen_tickers:
             quantity = np.random.randint(1, max_shares + 1)
-            buy_date = np.random.choice(self.data.index)
+            buy_date = np.random.choice(self.calendar.index[lo:hi])
             self.buy_asset(ticker, quantity, at_date=buy_date)
             
 
@@ -239,7 +475,7 @@ class Portfolio:
     def set_cash(self, amount:float, at_date=None):
         """Sets the current cash to a specific amount."""
         if amount < 0:
-            print("Cash amount cannot be negative.")
+            self.sink.emit('cash_set_rejected', amount=amount)
             return
         difference = amount - self.current_cash
         self.current_cash = amount
@@ -247,13 +483,13 @@ class Portfolio:
         #log cash justering
         at_date = pd.to_datetime(at_date) if at_date else pd.Timestamp.now()
         self.log_transaction("Cash Adjustment", at_date, "CASH", 1, difference, difference)
-        print(f"Current cash set to {self.current_cash:.2f}.")
+        self.sink.emit('cash_set', cash=self.current_cash, difference=difference, date=at_date)
     
     def adjust_cash(self, amount:float, at_date=None):
         """__summary__
         Adds or removes(-) a specific amount to the current cash and logs the transaction"""
         if self.current_cash + amount < 0:
-            print("Insufficient cash to adjust by this amount.")
+            self.sink.emit('cash_adjust_rejected', amount=amount, cash=self.current_cash)
             return
         self.current_cash += amount
         
@@ -262,7 +498,7 @@ class Portfolio:
        
         self.log_transaction("Cash Adjustment", at_date, "CASH", 1, amount, amount)
         
-        print(f"Cash adjustet, new balance: {self.current_cash:.2f}.")
+        self.sink.emit('cash_adjusted', cash=self.current_cash, amount=amount, date=at_date)
     
     def calculate_risk_metrics(self, risk_free_rate=0.0):
         """
@@ -0,0 +1,203 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+values_file = 'values.npy'
+dates_file = 'dates.npy'
+meta_file = 'meta.json'
+
+
+class PriceCube:
+    """
+    Dense dates x tickers x fields float array with integer lookup maps.
+    Can be saved to disk and opened memory-mapped, so many processes share one copy of the prices.
+    """
+    def __init__(self, values: np.ndarray, dates, tickers, fields):
+        if values.ndim != 3 or values.shape != (len(dates), len(tickers), len(fields)):
+            raise ValueError("values must have shape (dates, tickers, fields)")
+        self.values = values
+        self.index = pd.DatetimeIndex(dates, name='Date')
+        self.tickers = pd.Index(tickers, name='Ticker')
+        self.fields = pd.Index(fields, name='Price')
+        self.ticker_map = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.field_map = {field: i for i, field in enumerate(self.fields)}
+
+    def __repr__(self):
+        return f"PriceCube(dates={len(self.index)}, tickers={len(self.tickers)}, fields={list(self.fields)})"
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, ticker):
+        return ticker in self.ticker_map
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, fields=None, dtype=np.float64):
+        """Builds a cube from the wide (ticker, field) frame returned by load_data. Non-numeric fields like 'Sector' are skipped."""
+        tickers = list(data.columns.get_level_values(0).unique())
+        if fields is None:
+            fields = []
+            for field in data.columns.get_level_values(1).unique():
+                dtypes = data.xs(field, level=1, axis=1).dtypes
+                if all(pd.api.types.is_numeric_dtype(dt) for dt in dtypes):
+                    fields.append(field)
+
+        values = np.full((len(data.index), len(tickers), len(fields)), np.nan, dtype=dtype)
+        for f, field in enumerate(fields):
+            field_frame = data.xs(field, level=1, axis=1).reindex(columns=tickers)
+            values[:, :, f] = field_frame.to_numpy(dtype=dtype, na_value=np.nan)
+        return cls(values, data.index, tickers, fields)
+
+    def save(self, path: str) -> None:
+        """Saves the cube as a folder with a raw .npy array that can be memory-mapped by open()."""
+        os.makedirs(path, exist_ok=True)
+        out = np.lib.format.open_memmap(os.path.join(path, values_file), mode='w+', dtype=self.values.dtype, shape=self.values.shape)
+        out[:] = self.values
+        out.flush()
+        del out
+        np.save(os.path.join(path, dates_file), self.index.values.astype('datetime64[ns]'))
+        with open(os.path.join(path, meta_file), 'w') as f:
+            json.dump({'tickers': list(self.tickers), 'fields': list(self.fields)}, f)
+
+    @classmethod
+    def open(cls, path: str, mode='r'):
+        """Opens a saved cube without reading the prices into memory. mode is passed to np.load(mmap_mode=...)."""
+        values = np.load(os.path.join(path, values_file), mmap_mode=mode)
+        dates = np.load(os.path.join(path, dates_file))
+        with open(os.path.join(path, meta_file)) as f:
+            meta = json.load(f)
+        return cls(values, dates, meta['tickers'], meta['fields'])
+
+    def date_loc(self, date) -> int:
+        """Integer position of a date in the index. Raises KeyError if the date is not a trading day."""
+        return self.index.get_loc(pd.Timestamp(date))
+
+    def ticker_loc(self, ticker) -> int:
+        return self.ticker_map[ticker]
+
+    def field_loc(self, field) -> int:
+        return self.field_map[field]
+
+    def get(self, date, ticker, field='Close') -> float:
+        """Price of a ticker on a date."""
+        return self.values[self.date_loc(date), self.ticker_map[ticker], self.field_map[field]]
+
+    def latest(self, ticker, field='Close') -> float:
+        """Price of a ticker on the last date in the cube."""
+        return self.values[-1, self.ticker_map[ticker], self.field_map[field]]
+
+    def series(self, ticker, field='Close') -> pd.Series:
+        """Zero-copy Series view of one ticker and field."""
+        return pd.Series(self.values[:, self.ticker_map[ticker], self.field_map[field]],
+                         index=self.index, name=(ticker, field), copy=False)
+
+    def frame(self, field='Close', tickers=None) -> pd.DataFrame:
+        """Dates x tickers frame of one field. Zero-copy when tickers is None."""
+        matrix = self.values[:, :, self.field_map[field]]
+        columns = self.tickers
+        if tickers is not None:
+            matrix = matrix[:, [self.ticker_map[ticker] for ticker in tickers]]
+            columns = pd.Index(tickers, name='Ticker')
+        return pd.DataFrame(matrix, index=self.index, columns=columns, copy=False)
+
+    def slice_dates(self, start=None, end=None):
+        """Cube view restricted to start <= date <= end. Shares memory with this cube."""
+        lo = 0 if start is None else self.index.searchsorted(pd.to_datetime(start), side='left')
+        hi = len(self.index) if end is None else self.index.searchsorted(pd.to_datetime(end), side='right')
+        return PriceCube(self.values[lo:hi], self.index[lo:hi], self.tickers, self.fields)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Wide (ticker, field) frame with the same layout as load_data, without the Sector column."""
+        n_dates, n_tickers, n_fields = self.values.shape
+        columns = pd.MultiIndex.from_product([self.tickers, self.fields], names=['Ticker', 'Price'])
+        return pd.DataFrame(np.asarray(self.values).reshape(n_dates, n_tickers * n_fields), index=self.index, columns=columns)
+
+
+#Fælles opslag, så Portfolio, BackTester og metrics virker med både DataFrame og PriceCube
+def get_tickers(data) -> pd.Index:
+    """Tickers available in a price frame or cube."""
+    if isinstance(data, PriceCube):
+        return data.tickers
+    return data.columns.levels[0]
+
+def has_ticker(data, ticker, field='Close') -> bool:
+    if isinstance(data, PriceCube):
+        return ticker in data.ticker_map and field in data.field_map
+    return (ticker, field) in data.columns
+
+def get_price(data, date, ticker, field='Close') -> float:
+    """Price of a ticker on a trading day."""
+    if isinstance(data, PriceCube):
+        return data.get(date, ticker, field)
+    return data.loc[date, (ticker, field)]
+
+def get_price_at(data, position: int, ticker, field='Close') -> float:
+    """Price of a ticker at an integer date position, e.g. one resolved by a TradingCalendar."""
+    if isinstance(data, PriceCube):
+        return data.values[position, data.ticker_map[ticker], data.field_map[field]]
+    return data.iat[position, data.columns.get_loc((ticker, field))]
+
+def get_prices_at(data, positions, tickers, fields) -> np.ndarray:
+    """
+    Vectorized price lookup for many (position, ticker, field) triples.
+    Unknown tickers or fields give NaN.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    prices = np.full(len(positions), np.nan)
+    if len(positions) == 0:
+        return prices
+    if isinstance(data, PriceCube):
+        ticker_idx = np.fromiter((data.ticker_map.get(t, -1) for t in tickers), dtype=np.int64, count=len(positions))
+        field_idx = np.fromiter((data.field_map.get(f, -1) for f in fields), dtype=np.int64, count=len(positions))
+        known = (ticker_idx >= 0) & (field_idx >= 0)
+        prices[known] = data.values[positions[known], ticker_idx[known], field_idx[known]]
+        return prices
+    keys = list(zip(tickers, fields))
+    locs = {}
+    for key in set(keys): #get_loc pr. unik kolonne er meget hurtigere end at bygge et MultiIndex til get_indexer
+        try:
+            locs[key] = data.columns.get_loc(key)
+        except KeyError:
+            locs[key] = -1
+    columns = np.fromiter((locs[key] for key in keys), dtype=np.int64, count=len(keys))
+    #et opslag pr. unik kolonne i stedet for et pr. ordre
+    for column in np.unique(columns[columns >= 0]):
+        rows = columns == column
+        if rows.sum() == 1:
+            prices[rows] = data.iat[positions[rows][0], column]
+        else:
+            prices[rows] = data.iloc[:, column].to_numpy(dtype=float, na_value=np.nan)[positions[rows]]
+    return prices
+
+def get_latest_price(data, ticker, field='Close') -> float:
+    """Price of a ticker on the last date in the data."""
+    if isinstance(data, PriceCube):
+        return data.latest(ticker, field)
+    return data[(ticker, field)].iloc[-1]
+
+def get_series(data, ticker, field='Close') -> pd.Series:
+    """Price series of one ticker."""
+    if isinstance(data, PriceCube):
+        return data.series(ticker, field)
+    return data[(ticker, field)]
+
+def get_field_frame(data, field='Close') -> pd.DataFrame:
+    """Dates x tickers frame of one field."""
+    if isinstance(data, PriceCube):
+        return data.frame(field)
+    return data.xs(field, level=1, axis=1)
+
+def slice_dates(data, start=None, end=None):
+    """Restricts a price frame or cube to start <= date <= end."""
+    if isinstance(data, PriceCube):
+        return data.slice_dates(start, end)
+    if start is not None:
+        data = data.loc[data.index >= pd.to_datetime(start)]
+    if end is not None:
+        data = data.loc[data.index <= pd.to_datetime(end)]
+    return data
@@ -0,0 +1,234 @@
+import os
+import time
+import random
+import threading
+import functools
+from abc import ABC, abstractmethod
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import numpy as np
+import pandas as pd
+
+gics_sectors = [
+    'Information Technology', 'Health Care', 'Financials', 'Consumer Discretionary', 'Communication Services',
+    'Industrials', 'Consumer Staples', 'Energy', 'Utilities', 'Real Estate', 'Materials'
+]
+tickers_file = 'tickers.csv'
+bars_folder = 'bars'
+
+
+class MarketDataProvider(ABC):
+    """ abstract base class for market data sources used by download_data """
+
+    @abstractmethod
+    def fetch_tickers(self) -> tuple[list, dict]:
+        """Returns tickers and a dictionary mapping tickers to their sectors."""
+        pass
+
+    @abstractmethod
+    def fetch_bars(self, tickers, start, end) -> pd.DataFrame:
+        """
+        Returns daily OHLCV bars as a wide frame with (ticker, field) columns and a Date index,
+        the same layout as load_data. start is inclusive, end is exclusive.
+        """
+        pass
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}()"
+
+
+class YFinanceProvider(MarketDataProvider):
+    """ S&P 500 constituents from Wikipedia and bars from Yahoo Finance """
+    sp500_url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+
+    def fetch_tickers(self) -> tuple[list, dict]:
+        #web scrape fra wikipedia
+        sp500 = pd.read_html(self.sp500_url)[0]
+        sp500['Symbol'] = sp500['Symbol'].str.replace(".", "-")
+        tickers = sp500['Symbol'].tolist()
+        sectors = dict(zip(sp500['Symbol'], sp500['GICS Sector']))
+        return tickers, sectors
+
+    def fetch_bars(self, tickers, start, end) -> pd.DataFrame:
+        import yfinance as yf #kun nødvendig når der rent faktisk hentes fra Yahoo
+        return yf.download(
+            tickers,
+            start=start,
+            end=end,
+            group_by='ticker',
+            progress=False
+        )
+
+
+class LocalProvider(MarketDataProvider):
+    """
+    Serves tickers, sectors and bars from fixtures, either from a folder on disk or from a local HTTP stand-in.
+
+    Fixture layout:
+        tickers.csv         Symbol, GICS Sector
+        bars/<TICKER>.csv   Date, Open, High, Low, Close, Volume
+    """
+    def __init__(self, root: str = None, base_url: str = None):
+        if (root is None) == (base_url is None):
+            raise ValueError("Give either a fixture folder (root) or a base_url")
+        self.root = root
+        self.base_url = base_url.rstrip('/') if base_url else None
+
+    def __repr__(self):
+        return f"LocalProvider(root={self.root!r}, base_url={self.base_url!r})"
+
+    def _location(self, *parts) -> str:
+        if self.root is not None:
+            return os.path.join(self.root, *parts)
+        return "/".join([self.base_url, *parts])
+
+    def fetch_tickers(self) -> tuple[list, dict]:
+        table = pd.read_csv(self._location(tickers_file))
+        tickers = table['Symbol'].tolist()
+        sectors = dict(zip(table['Symbol'], table['GICS Sector']))
+        return tickers, sectors
+
+    def _read_bars(self, ticker) -> pd.DataFrame:
+        location = self._location(bars_folder, f"{ticker}.csv")
+        if self.root is not None and not os.path.exists(location):
+            return None
+        try:
+            return pd.read_csv(location, index_col='Date', parse_dates=['Date'])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            if getattr(e, 'code', None) == 404: #ukendt ticker på serveren
+                return None
+            raise
+
+    def fetch_bars(self, tickers, start, end) -> pd.DataFrame:
+        start = pd.to_datetime(start)
+        end = pd.to_datetime(end)
+        frames = {}
+        for ticker in tickers:
+            bars = self._read_bars(ticker)
+            if bars is None:
+                continue
+            frames[ticker] = bars.loc[(bars.index >= start) & (bars.index < end)]
+        if not frames:
+            return pd.DataFrame()
+        data = pd.concat(frames, axis=1).sort_index()
+        data.columns.names = ['Ticker', 'Price']
+        data.index.name = 'Date'
+        return data
+
+
+def write_fixtures(root: str, data: pd.DataFrame, sectors: dict) -> None:
+    """Writes a wide (ticker, field) price frame and a ticker -> sector mapping as LocalProvider fixtures."""
+    os.makedirs(os.path.join(root, bars_folder), exist_ok=True)
+    tickers = list(data.columns.get_level_values(0).unique())
+    pd.DataFrame({
+        'Symbol': tickers,
+        'GICS Sector': [sectors.get(ticker, 'Unknown') for ticker in tickers]
+    }).to_csv(os.path.join(root, tickers_file), index=False)
+    for ticker in tickers:
+        bars = data[ticker].dropna(how='all')
+        bars.columns.name = None
+        bars.to_csv(os.path.join(root, bars_folder, f"{ticker}.csv"), index_label='Date')
+
+def generate_fixtures(root: str, n_tickers=500, start="2015-01-01", end=None, seed=123) -> tuple[list, dict]:
+    """
+    Generates synthetic S&P 500 sized fixtures (geometric random walks with OHLCV bars) for offline runs and benchmarks.
+    Returns tickers and sectors like fetch_tickers.
+    """
+    rng = np.random.default_rng(seed)
+    end = pd.to_datetime(end) if end is not None else pd.to_datetime('today').normalize()
+    dates = pd.bdate_range(start, end, inclusive='left', name='Date')
+    n_dates = len(dates)
+
+    tickers = [f"T{i:03d}" for i in range(n_tickers)]
+    sectors = {ticker: gics_sectors[i % len(gics_sectors)] for i, ticker in enumerate(tickers)}
+
+    drift = rng.normal(0.0003, 0.0002, size=n_tickers)
+    volatility = rng.uniform(0.01, 0.03, size=n_tickers)
+    log_returns = rng.normal(drift, volatility, size=(n_dates, n_tickers))
+    close = rng.uniform(20, 300, size=n_tickers) * np.exp(np.cumsum(log_returns, axis=0))
+    open_ = close * np.exp(rng.normal(0, volatility / 2, size=(n_dates, n_tickers)))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, volatility / 2, size=(n_dates, n_tickers))))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, volatility / 2, size=(n_dates, n_tickers))))
+    volume = rng.integers(100_000, 10_000_000, size=(n_dates, n_tickers)).astype(float)
+
+    fields = {'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume}
+    os.makedirs(os.path.join(root, bars_folder), exist_ok=True)
+    pd.DataFrame({'Symbol': tickers, 'GICS Sector': [sectors[ticker] for ticker in tickers]}).to_csv(
+        os.path.join(root, tickers_file), index=False)
+    for i, ticker in enumerate(tickers):
+        bars = pd.DataFrame({field: values[:, i] for field, values in fields.items()}, index=dates)
+        bars.to_csv(os.path.join(root, bars_folder, f"{ticker}.csv"), index_label='Date')
+    return tickers, sectors
+
+
+class FixtureServer:
+    """
+    Local HTTP stand-in that serves a fixture folder, so LocalProvider(base_url=server.url) exercises the network path.
+    It can add latency to every request and fail a share of them with 503, to test retries and throughput.
+    Use as a context manager or call start() and stop().
+    """
+    def __init__(self, root: str, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, seed=None):
+        if not 0 <= failure_rate <= 1:
+            raise ValueError("failure_rate must be between 0 and 1")
+        self.root = root
+        handler = functools.partial(_FixtureHandler, directory=root)
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.latency = latency
+        self._server.failure_rate = failure_rate
+        self._server.rng = random.Random(seed)
+        self._server.rng_lock = threading.Lock()
+        self._server.requests = 0
+        self._server.failures = 0
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self) -> int:
+        """Number of requests served, including simulated failures."""
+        return self._server.requests
+
+    @property
+    def failures(self) -> int:
+        """Number of simulated failures."""
+        return self._server.failures
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.rng_lock:
+            server.requests += 1
+            fail = server.rng.random() < server.failure_rate
+            if fail:
+                server.failures += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if fail:
+            self.send_error(503, "Simulated failure")
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,106 @@
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from pricecube import PriceCube
+
+
+class _Entry:
+    """Close and return columns of one dataset and date range, filled in per ticker as they are asked for."""
+    def __init__(self, data_ref, lo, hi, index):
+        self.data_ref = data_ref #svag reference, så cachen ikke holder gamle datasæt i live
+        self.lo = lo
+        self.hi = hi
+        self.index = index
+        self.close = {}
+        self.returns = {}
+
+
+class ReturnsCache:
+    """
+    LRU cache of close prices and daily returns per dataset and date range.
+    Entries are keyed by the identity of the price data and the resolved trading day range, and only the
+    columns that are asked for are read and turned into returns. Columns are cached as read-only arrays,
+    so repeated risk reports on the same data only assemble the held columns instead of recomputing all tickers.
+    The cache only holds weak references to the data, and the entries of a dataset are dropped when it is freed.
+    The data is assumed not to change in place while it is cached, call clear() if it does.
+    """
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"ReturnsCache(entries={len(self._entries)}, maxsize={self.maxsize}, hits={self.hits}, misses={self.misses})"
+
+    def clear(self):
+        self._entries.clear()
+
+    def _entry(self, data, start, end) -> _Entry:
+        index = data.index
+        lo = 0 if start is None else index.searchsorted(pd.Timestamp(start), side='left')
+        hi = len(index) if end is None else index.searchsorted(pd.Timestamp(end), side='right')
+        key = (id(data), lo, hi)
+        entry = self._entries.get(key)
+        if entry is not None and entry.data_ref() is data:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        data_ref = weakref.ref(data, lambda ref, key=key: self._drop(key, ref))
+        entry = self._entries[key] = _Entry(data_ref, lo, hi, index[lo:hi])
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    def _drop(self, key, data_ref) -> None:
+        """Removes an entry when its data is freed, unless the key has been reused for newer data."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.data_ref is data_ref:
+            del self._entries[key]
+
+    def _load(self, entry: _Entry, data, tickers) -> None:
+        """Reads the close prices of the tickers that are not cached yet and computes their returns in one go."""
+        missing = [ticker for ticker in dict.fromkeys(tickers) if ticker not in entry.close]
+        if not missing:
+            return
+        n = entry.hi - entry.lo
+        if isinstance(data, PriceCube):
+            field = data.field_map['Close']
+            idx = [data.ticker_map[ticker] for ticker in missing]
+            close = np.asarray(data.values[entry.lo:entry.hi, idx, field], dtype=float)
+        else:
+            close = np.empty((n, len(missing)))
+            for j, ticker in enumerate(missing):
+                close[:, j] = data[(ticker, 'Close')].iloc[entry.lo:entry.hi].to_numpy(dtype=float, na_value=np.nan) #kun perioden konverteres
+        returns = pd.DataFrame(close).pct_change().to_numpy()[1:]
+        close.flags.writeable = False
+        returns.flags.writeable = False
+        for j, ticker in enumerate(missing):
+            entry.close[ticker] = close[:, j]
+            entry.returns[ticker] = returns[:, j]
+
+    def close(self, data, tickers, start=None, end=None) -> pd.DataFrame:
+        """Dates x tickers close prices with start <= date <= end. Treat the frame as read-only."""
+        entry = self._entry(data, start, end)
+        self._load(entry, data, tickers)
+        return pd.DataFrame({ticker: entry.close[ticker] for ticker in tickers}, index=entry.index,
+                            columns=pd.Index(tickers, name='Ticker'), copy=False)
+
+    def returns(self, data, tickers, start=None, end=None) -> pd.DataFrame:
+        """
+        Daily returns (pct_change of close) of the tickers with start <= date <= end.
+        The first day of the range has no return and is left out. Treat the frame as read-only.
+        """
+        entry = self._entry(data, start, end)
+        self._load(entry, data, tickers)
+        return pd.DataFrame({ticker: entry.returns[ticker] for ticker in tickers}, index=entry.index[1:],
+                            columns=pd.Index(tickers, name='Ticker'), copy=False)
+
+
+#delt cache for Portfolio.portfolio_returns og metrics.portfolio_returns
+returns_cache = ReturnsCache()
@@ -0,0 +1,66 @@
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+
+class SharedMatrix:
+    """
+    A numpy array in named shared memory, so worker processes can read one copy of the prices instead of a pickled copy each.
+    The creating process owns the memory and unlinks it on close(). Workers attach with SharedMatrix.attach(spec)
+    using the picklable spec of the owner.
+    """
+    def __init__(self, shm, shape, dtype, owner):
+        self._shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    def __repr__(self):
+        return f"SharedMatrix(name={self._shm.name!r}, shape={self.shape}, dtype={self.dtype})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @classmethod
+    def from_array(cls, array: np.ndarray):
+        """Copies array into a new shared memory block."""
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        matrix = cls(shm, array.shape, array.dtype, owner=True)
+        matrix.array[...] = array
+        return matrix
+
+    @property
+    def spec(self) -> tuple:
+        """(name, shape, dtype) needed by attach() in another process."""
+        return self._shm.name, self.shape, self.dtype.str
+
+    @classmethod
+    def attach(cls, spec):
+        """Attaches to a block created by from_array in another process. The result is read-only."""
+        name, shape, dtype = spec
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError: #Python < 3.13 har ikke track, og resource_tracker ville ellers fjerne blokken når workeren lukker
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args, **kwargs: None
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        matrix = cls(shm, shape, dtype, owner=False)
+        matrix.array.flags.writeable = False
+        return matrix
+
+    def close(self):
+        """Releases the mapping, and frees the shared memory if this process created it."""
+        if self._shm is None:
+            return
+        self.array = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+        self._shm = None
@@ -0,0 +1,142 @@
+import numpy as np
+
+#Signaler og statistik som rene numpy funktioner på dates x tickers matricer, delt af BackTester og sweep
+
+
+def rolling_sums(values: np.ndarray):
+    """
+    Cumulative sums of values, values squared and the count of valid values along axis 0, with a leading zero row.
+    Computed once and reused for any number of rolling windows, see rolling_mean and rolling_std.
+    """
+    valid = np.isfinite(values)
+    clean = np.where(valid, values, 0.0)
+    zero = np.zeros((1,) + values.shape[1:])
+    return (np.concatenate([zero, np.cumsum(clean, axis=0)]),
+            np.concatenate([zero, np.cumsum(clean * clean, axis=0)]),
+            np.concatenate([zero, np.cumsum(valid, axis=0)]))
+
+def _window_diff(cumulative: np.ndarray, window: int) -> np.ndarray:
+    out = np.full((len(cumulative) - 1,) + cumulative.shape[1:], np.nan)
+    if window <= len(out):
+        out[window - 1:] = cumulative[window:] - cumulative[:-window]
+    return out
+
+def rolling_mean(sums, window: int) -> np.ndarray:
+    """Rolling mean from rolling_sums, NaN until the window holds window valid values like pandas rolling(window).mean()."""
+    total, _, count = sums
+    n_valid = _window_diff(count, window)
+    with np.errstate(invalid='ignore'):
+        return np.where(n_valid == window, _window_diff(total, window) / window, np.nan)
+
+def rolling_std(sums, window: int) -> np.ndarray:
+    """Rolling sample standard deviation (ddof=1) from rolling_sums, like pandas rolling(window).std()."""
+    total, squares, count = sums
+    n_valid = _window_diff(count, window)
+    window_total = _window_diff(total, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = (_window_diff(squares, window) - window_total * window_total / window) / (window - 1)
+        return np.where(n_valid == window, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+
+
+def ma_crossover_stats(prices: np.ndarray, ma: np.ndarray, window: int) -> dict:
+    """
+    All-in MA crossover strategy of BackTester.moving_average_strat for every column of a dates x tickers matrix:
+    buy when the price crosses above its moving average, sell when it crosses below, open positions are valued
+    at the last price. Returns arrays of Total Return, Buy-and-Hold Return, Trades, Round Trips and Win Rate per column.
+    """
+    # Signal og skift, som i moving_average_strat
+    signal = np.zeros(prices.shape, dtype=np.int8)
+    with np.errstate(invalid='ignore'):
+        signal[window:] = np.where(prices[window:] > ma[window:], 1, -1)
+    change = np.diff(signal, axis=0, prepend=signal[:1])
+
+    # Køb ved hvert skift fra -1 til 1, salg ved skift fra 1 til -1 når der ejes aktier
+    buys = change == 2
+    held = (signal == 1) & (np.cumsum(buys, axis=0) > 0)
+    held_before = np.vstack([np.zeros((1,) + held.shape[1:], dtype=bool), held[:-1]])
+    sells = (change == -2) & held_before
+
+    valid = np.isfinite(prices)
+    any_valid = valid.any(axis=0)
+    last_price = np.where(any_valid, prices[len(prices) - 1 - np.argmax(valid[::-1], axis=0), np.arange(prices.shape[1])], np.nan)
+    first_price = np.where(any_valid, prices[np.argmax(valid, axis=0), np.arange(prices.shape[1])], np.nan)
+
+    # All-in afkast: produktet af salgspris/købspris over handlerne, åbne positioner værdisættes til sidste kurs
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log_prices = np.log(prices)
+        growth = (np.where(sells, log_prices, 0.0).sum(axis=0) - np.where(buys, log_prices, 0.0).sum(axis=0)
+                  + np.where(held[-1], np.log(last_price), 0.0))
+        total_return = np.exp(growth) - 1
+        bh_return = last_price / first_price - 1
+
+        # Round trips: salgsprisen sammenlignet med prisen ved det seneste køb
+        buy_index = np.where(buys, np.arange(len(prices))[:, None], 0)
+        buy_index = np.maximum.accumulate(buy_index, axis=0)
+        buy_price = np.take_along_axis(prices, buy_index, axis=0)
+        round_trips = sells.sum(axis=0)
+        wins = (sells & (prices > buy_price)).sum(axis=0)
+        win_rate = np.where(round_trips > 0, wins / np.maximum(round_trips, 1), 0.0)
+
+    return {
+        'Total Return': total_return,
+        'Buy-and-Hold Return': bh_return,
+        'Outperformance': total_return - bh_return,
+        'Trades': buys.sum(axis=0) + round_trips,
+        'Round Trips': round_trips,
+        'Win Rate': win_rate,
+    }
+
+
+def hysteresis_positions(zscore: np.ndarray, z_entry: float, z_exit: float) -> np.ndarray:
+    """
+    Position state of generate_pairs_trading_signals for a z-score series, or for every column of a dates x pairs
+    matrix: 1 (long spread) after z < -z_entry, -1 (short spread) after z > z_entry, back to 0 when |z| < z_exit.
+    NaN z-scores trigger nothing.
+
+    When z_exit <= z_entry an exit bar can never be an entry bar, so the state on a bar is set by the first entry
+    after the last exit, which is found with two accumulations instead of a loop. Otherwise a loop is used.
+    """
+    zscore = np.asarray(zscore, dtype=float)
+    if z_exit > z_entry:
+        return _hysteresis_loop(zscore, z_entry, z_exit)
+    n = len(zscore)
+    shape = zscore.shape
+    with np.errstate(invalid='ignore'):
+        direction = np.where(zscore < -z_entry, 1, np.where(zscore > z_entry, -1, 0)).astype(np.int8)
+        is_exit = np.abs(zscore) < z_exit
+    index = np.arange(n).reshape((n,) + (1,) * (len(shape) - 1))
+
+    # seneste exit til og med hver dag (-1 hvis ingen), og første entry fra og med hver dag (n hvis ingen)
+    last_exit = np.maximum.accumulate(np.where(is_exit, index, -1), axis=0)
+    next_entry = np.minimum.accumulate(np.where(direction != 0, index, n)[::-1], axis=0)[::-1]
+    next_entry = np.concatenate([next_entry, np.full((1,) + shape[1:], n)], axis=0)
+
+    # første entry efter seneste exit, hvis den er sket endnu
+    entry = np.take_along_axis(next_entry, last_exit + 1, axis=0)
+    in_position = entry <= index
+    entry_direction = np.take_along_axis(direction, np.minimum(entry, n - 1), axis=0) if n else direction
+    return np.where(in_position, entry_direction, 0).astype(np.int8)
+
+def _hysteresis_loop(zscore: np.ndarray, z_entry: float, z_exit: float) -> np.ndarray:
+    """Bar by bar version of hysteresis_positions, used when z_exit > z_entry."""
+    if zscore.ndim > 1:
+        columns = zscore.reshape(len(zscore), -1)
+        return np.column_stack([_hysteresis_loop(columns[:, j], z_entry, z_exit)
+                                for j in range(columns.shape[1])]).reshape(zscore.shape) if columns.shape[1] else np.zeros(zscore.shape, dtype=np.int8)
+    state = np.zeros(len(zscore), dtype=np.int8)
+    current = 0
+    for i, z in enumerate(zscore.tolist()):
+        if current == 0:
+            if z < -z_entry:
+                current = 1
+            elif z > z_entry:
+                current = -1
+        elif abs(z) < z_exit:
+            current = 0
+        state[i] = current
+    return state
+
+def pairs_daily_returns(state: np.ndarray, beta: float, ret1: np.ndarray, ret2: np.ndarray) -> np.ndarray:
+    """Daily returns of a pair position state: pos1 = state, pos2 = -beta * state, held from the day after the signal."""
+    previous = np.concatenate([[0], state[:-1]]).astype(float)
+    return previous * ret1 - beta * previous * ret2
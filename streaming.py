@@ -0,0 +1,381 @@
+import math
+from abc import ABC, abstractmethod
+from collections import deque
+import numpy as np
+import pandas as pd
+from pricecube import get_series
+from tradingcalendar import get_calendar
+
+
+class Bar:
+    """One date of prices. prices maps (ticker, field) to the price on that date."""
+    __slots__ = ('date', 'position', 'prices')
+
+    def __init__(self, date, position, prices: dict):
+        self.date = date
+        self.position = position
+        self.prices = prices
+
+    def __repr__(self):
+        return f"Bar({self.date.date()}, prices={len(self.prices)})"
+
+    def price(self, ticker, field='Close') -> float:
+        return self.prices.get((ticker, field), np.nan)
+
+
+def iter_bars(data, tickers, fields=('Close',), start_date=None, end_date=None):
+    """
+    Generator of Bars from a price frame or cube, one per trading day with start_date <= date <= end_date.
+    Only the requested tickers and fields are read, as views of the price columns, and one Bar is built at a time.
+    """
+    calendar = get_calendar(data)
+    lo, hi = calendar.slice_positions(start_date, end_date)
+    keys = [(ticker, field) for ticker in tickers for field in fields]
+    columns = [get_series(data, ticker, field).to_numpy() for ticker, field in keys]
+    for position in range(lo, hi):
+        yield Bar(calendar[position], position, {key: column[position] for key, column in zip(keys, columns)})
+
+
+#Rullende indikatorer. Hver opdatering er O(1) og hukommelsen er konstant (et vindue af værdier)
+class RollingWindow:
+    """
+    Running count, sum and sum of squares over the last window values. NaN values take up a place in the window
+    but are not counted, like pandas rolling(window) with min_periods=window.
+    Sums are kept around a shift and recomputed from the window every window updates, so rounding errors cannot build up.
+    """
+    def __init__(self, window: int):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.shift = None
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self._updates = 0
+
+    def update(self, value: float):
+        if len(self.values) == self.window:
+            self._remove(self.values[0])
+        self.values.append(value)
+        if value == value: #ikke NaN
+            if self.shift is None:
+                self.shift = value
+            x = value - self.shift
+            self.count += 1
+            self.sum += x
+            self.sum_squares += x * x
+        self._updates += 1
+        if self._updates >= self.window:
+            self._recompute()
+
+    def _remove(self, value):
+        if value == value:
+            x = value - self.shift
+            self.count -= 1
+            self.sum -= x
+            self.sum_squares -= x * x
+
+    def _recompute(self):
+        self._updates = 0
+        valid = [value for value in self.values if value == value]
+        self.shift = valid[-1] if valid else None
+        self.count = len(valid)
+        self.sum = math.fsum(value - self.shift for value in valid)
+        self.sum_squares = math.fsum((value - self.shift) ** 2 for value in valid)
+
+    @property
+    def ready(self) -> bool:
+        return self.count == self.window
+
+
+class RollingMean(RollingWindow):
+    """Rolling mean, NaN until the window is full."""
+    def update(self, value: float) -> float:
+        super().update(value)
+        return self.value
+
+    @property
+    def value(self) -> float:
+        if not self.ready:
+            return np.nan
+        return self.shift + self.sum / self.count
+
+
+class RollingStd(RollingWindow):
+    """Rolling sample standard deviation (ddof=1), NaN until the window is full."""
+    def update(self, value: float) -> float:
+        super().update(value)
+        return self.value
+
+    @property
+    def mean(self) -> float:
+        if not self.ready:
+            return np.nan
+        return self.shift + self.sum / self.count
+
+    @property
+    def value(self) -> float:
+        if not self.ready or self.count < 2:
+            return np.nan
+        variance = (self.sum_squares - self.sum * self.sum / self.count) / (self.count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+
+class RollingZScore(RollingStd):
+    """(value - rolling mean) / rolling std of the last window values. 0 until the window is full or if the std is 0."""
+    def update(self, value: float) -> float:
+        RollingWindow.update(self, value)
+        std = self.value
+        if not std > 0 or value != value:
+            return 0.0
+        return (value - self.mean) / std
+
+
+class RollingBeta:
+    """Rolling OLS slope of y on x (with a constant) over the last window pairs."""
+    def __init__(self, window: int):
+        self.window = window
+        self.x = RollingStd(window)
+        self.y = RollingMean(window)
+        self.xy = RollingMean(window)
+
+    def update(self, x: float, y: float) -> float:
+        self.x.update(x)
+        self.y.update(y)
+        self.xy.update(x * y)
+        return self.value
+
+    @property
+    def value(self) -> float:
+        variance = self.x.value ** 2
+        if not variance > 0:
+            return np.nan
+        n = self.window
+        covariance = (self.xy.value - self.x.mean * self.y.value) * n / (n - 1)
+        return covariance / variance
+
+
+class Context:
+    """What a strategy sees and trades through: the current bar, and orders that go straight to the Portfolio."""
+    def __init__(self, portfolio):
+        self.portfolio = portfolio
+        self.bar = None
+        self.fills = []
+
+    @property
+    def date(self):
+        return self.bar.date
+
+    @property
+    def cash(self) -> float:
+        return self.portfolio.current_cash
+
+    def price(self, ticker, field='Close') -> float:
+        return self.bar.price(ticker, field)
+
+    def position(self, ticker):
+        return self.portfolio.get_asset_quantity(ticker)
+
+    def _order(self, method, ticker, quantity, open):
+        n = len(self.portfolio.log)
+        method(ticker, quantity, at_date=self.bar.date, open=open)
+        if len(self.portfolio.log) > n:
+            fill = self.portfolio.log[-1]
+            self.fills.append(fill)
+            return fill
+        return None
+
+    def buy(self, ticker, quantity, open=False):
+        """Buys at the close (or open) of the current bar. Returns the logged fill, or None if rejected."""
+        return self._order(self.portfolio.buy_asset, ticker, quantity, open)
+
+    def sell(self, ticker, quantity, open=False):
+        """Sells at the close (or open) of the current bar. Returns the logged fill, or None if rejected."""
+        return self._order(self.portfolio.sell_asset, ticker, quantity, open)
+
+    def buy_max(self, ticker):
+        """Buys as many shares as the cash allows, like BackTester.buy_max."""
+        max_shares = int(self.cash / self.price(ticker))
+        if max_shares > 0:
+            return self.buy(ticker, max_shares)
+        return None
+
+    def sell_all(self, ticker):
+        """Sells the whole position, like BackTester.sell_all."""
+        shares = self.position(ticker)
+        if shares > 0:
+            return self.sell(ticker, shares)
+        return None
+
+
+class Strategy(ABC):
+    """
+    Abstract base class for streaming strategies. on_bar is called once per bar, on_fill after each of the strategy's own fills.
+    on_start, on_fill and on_finish are optional hooks that do nothing by default.
+    tickers and fields tell the engine which prices to put on the bars.
+    """
+    tickers = ()
+    fields = ('Close',)
+
+    def on_start(self, ctx: Context):
+        pass
+
+    @abstractmethod
+    def on_bar(self, ctx: Context, bar: Bar):
+        """Reacts to one bar, e.g. by placing orders through ctx. Must be implemented by subclasses."""
+        pass
+
+    def on_fill(self, ctx: Context, fill: dict):
+        pass
+
+    def on_finish(self, ctx: Context):
+        pass
+
+
+class StreamingBacktester:
+    """
+    Event-driven backtester: feeds bars one at a time to a Strategy and routes its orders through the Portfolio.
+    Nothing is computed ahead of time, so any iterable of Bars works, e.g. a replay of live data.
+    """
+    def __init__(self, portfolio, strategy: Strategy):
+        self.portfolio = portfolio
+        self.strategy = strategy
+        self.context = Context(portfolio)
+
+    def run(self, bars=None, start_date=None, end_date=None, record_nav=False):
+        """
+        Runs the strategy over bars (default: iter_bars over the portfolio data).
+
+        Returns:
+            pd.Series or None: NAV after every bar if record_nav is True.
+        """
+        if bars is None:
+            bars = iter_bars(self.portfolio.data, self.strategy.tickers, self.strategy.fields, start_date, end_date)
+        ctx, strategy = self.context, self.strategy
+        strategy.on_start(ctx)
+        dates, navs = [], []
+        for bar in bars:
+            ctx.bar = bar
+            n_fills = len(ctx.fills)
+            strategy.on_bar(ctx, bar)
+            for fill in ctx.fills[n_fills:]:
+                strategy.on_fill(ctx, fill)
+            ctx.fills.clear()
+            if record_nav:
+                dates.append(bar.date)
+                navs.append(self.portfolio.get_portfolio_value(at_date=bar.date))
+        strategy.on_finish(ctx)
+        if record_nav:
+            return pd.Series(navs, index=pd.DatetimeIndex(dates, name='Date'), name='NAV')
+        return None
+
+
+class MovingAverageStrategy(Strategy):
+    """BackTester.moving_average_strat as a streaming strategy: all-in when the price crosses above its moving average, out when it crosses below."""
+    def __init__(self, ticker, window=30):
+        self.tickers = (ticker,)
+        self.ticker = ticker
+        self.window = window
+        self.ma = RollingMean(window)
+        self.signal = 0
+        self.bars = 0
+
+    def on_bar(self, ctx, bar):
+        price = bar.price(self.ticker)
+        ma = self.ma.update(price)
+        signal = 0
+        if self.bars >= self.window: #samme startdag som moving_average_strat
+            signal = 1 if price > ma else -1
+        if signal - self.signal == 2:
+            ctx.buy_max(self.ticker)
+        elif signal - self.signal == -2:
+            ctx.sell_all(self.ticker)
+        self.signal = signal
+        self.bars += 1
+
+
+class SellInMayStrategy(Strategy):
+    """BackTester.sell_in_may_and_go_away_strategy as a streaming strategy: out from May to October, all-in otherwise."""
+    def __init__(self, ticker):
+        self.tickers = (ticker,)
+        self.ticker = ticker
+
+    def on_bar(self, ctx, bar):
+        if 5 <= bar.date.month <= 10:
+            ctx.sell_all(self.ticker)
+        else:
+            ctx.buy_max(self.ticker)
+
+
+class PairsTradingStrategy(Strategy):
+    """
+    The pairs trading rules of BackTester.pairs_trading_strategy as a streaming strategy.
+    The spread is ticker1 - beta * ticker2 on prices normalized by their first value, and its rolling z-score drives
+    the entry/exit rules. With beta=None the hedge ratio is a rolling OLS beta over beta_window bars, fixed at entry,
+    otherwise the given beta is used (e.g. from compute_spread, which gives the same signals as pairs_trading_strategy).
+    Portfolio has no short positions, so like pairs_trading_strategy the pair is tracked as a return stream
+    (state, returns, cumulative_return) instead of orders. Bars where either price is missing are skipped.
+    """
+    def __init__(self, ticker1, ticker2, zscore_window=30, z_entry=2.3, z_exit=0.5, beta=None, beta_window=60, record=False):
+        self.tickers = (ticker1, ticker2)
+        self.ticker1, self.ticker2 = ticker1, ticker2
+        self.z_entry, self.z_exit = z_entry, z_exit
+        self.fixed_beta = beta
+        self.rolling_beta = RollingBeta(beta_window) if beta is None else None
+        self.zscore = RollingZScore(zscore_window)
+        self.first = None
+        self.previous = None
+        self.state = 0
+        self.position_beta = 0.0
+        self.cumulative_return = 0.0
+        self.trades = 0
+        self.record = record
+        self.history = [] if record else None
+
+    def on_bar(self, ctx, bar):
+        p1, p2 = bar.price(self.ticker1), bar.price(self.ticker2)
+        if not (np.isfinite(p1) and np.isfinite(p2)):
+            return
+        if self.first is None:
+            self.first = (p1, p2)
+        x1, x2 = p1 / self.first[0], p2 / self.first[1]
+
+        # afkast af gårsdagens position
+        daily_return = 0.0
+        if self.previous is not None and self.state != 0:
+            ret1 = p1 / self.previous[0] - 1
+            ret2 = p2 / self.previous[1] - 1
+            daily_return = self.state * ret1 - self.position_beta * self.state * ret2
+        self.cumulative_return = (1 + self.cumulative_return) * (1 + daily_return) - 1
+        self.previous = (p1, p2)
+
+        beta = self.fixed_beta if self.rolling_beta is None else self.rolling_beta.update(x2, x1)
+        if beta == beta:
+            z = self.zscore.update(x1 - beta * x2)
+        else:
+            z = 0.0
+
+        state = self.state
+        if state == 0:
+            if z < -self.z_entry:
+                state = 1
+            elif z > self.z_entry:
+                state = -1
+            if state != 0:
+                self.position_beta = beta
+        elif abs(z) < self.z_exit:
+            state = 0
+        if state != self.state:
+            self.trades += 1
+        self.state = state
+        if self.record:
+            self.history.append((bar.date, z, state, daily_return))
+
+    def to_frame(self) -> pd.DataFrame:
+        """Recorded zscore, signal and returns per bar (needs record=True)."""
+        if self.history is None:
+            raise ValueError("Strategy was created with record=False")
+        frame = pd.DataFrame(self.history, columns=['Date', 'zscore', 'signal', 'returns']).set_index('Date')
+        frame['comulative_returns'] = (1 + frame['returns']).cumprod() - 1 #samme kolonnenavn som generate_pairs_trading_signals
+        return frame
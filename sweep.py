@@ -0,0 +1,310 @@
+import os
+import itertools
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from pricecube import get_tickers, get_field_frame, slice_dates
+from pairs_trading import compute_spread, candidate_pairs, check_tickers
+from cointegration import coint_pvalues
+from signals import rolling_sums, rolling_mean, rolling_std, ma_crossover_stats, hysteresis_positions, pairs_daily_returns
+from sharedmem import SharedMatrix
+
+annual_factor = 251 #samme antal handelsdage som RiskMetrics
+
+#Workerens tilstand: close matrix (delt hukommelse), datoer og tickers. Sættes af _init_worker
+_context = {}
+
+
+def _init_worker(spec, index, tickers):
+    matrix = SharedMatrix.attach(spec)
+    _set_context(matrix.array, index, tickers)
+    _context['matrix'] = matrix #holder blokken åben så længe workeren lever
+
+def _set_context(close, index, tickers):
+    _context.update(close=close, index=index, tickers=pd.Index(tickers),
+                    ticker_map={ticker: i for i, ticker in enumerate(tickers)})
+
+
+def _return_stats(returns: np.ndarray) -> dict:
+    """Total return and RiskMetrics style annualized figures of a daily return series."""
+    n = len(returns)
+    growth = np.cumprod(1 + returns)
+    total_return = growth[-1] - 1 if n else 0.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        annualized_return = (1 + total_return) ** (annual_factor / n) - 1 if n else np.nan
+        annualized_volatility = returns.std(ddof=1) * np.sqrt(annual_factor) if n > 1 else np.nan
+        sharpe_ratio = annualized_return / annualized_volatility if annualized_volatility > 0 else np.nan
+        max_drawdown = (growth / np.maximum.accumulate(np.concatenate([[1.0], growth]))[1:] - 1).min() if n else 0.0
+    return {'Total Return': total_return, 'Annualized Return': annualized_return,
+            'Annualized Volatility': annualized_volatility, 'Sharpe Ratio': sharpe_ratio, 'Max Drawdown': max_drawdown}
+
+
+def _ma_task(task) -> pd.DataFrame:
+    """All windows for a block of tickers. The cumulative sums are computed once and reused for every window."""
+    columns, windows = task
+    close = _context['close'][:, columns]
+    sums = rolling_sums(close)
+    frames = []
+    for window in windows:
+        if window >= len(close):
+            continue
+        stats = ma_crossover_stats(close, rolling_mean(sums, window), window)
+        frame = pd.DataFrame(stats)
+        frame.insert(0, 'Ticker', _context['tickers'][columns])
+        frame.insert(1, 'window', window)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def _pairs_task(task) -> pd.DataFrame:
+    """
+    Whole parameter grid for one pair. The spread and hedge ratio are computed once, the rolling sums of the spread
+    once, the z-score once per zscore_window, and only the entry/exit rules run per grid point.
+    """
+    t1, t2, zscore_windows, thresholds = task
+    close, index, ticker_map = _context['close'], _context['index'], _context['ticker_map']
+    # samme rensning som pairs_trading_strategy
+    s1 = pd.Series(close[:, ticker_map[t1]], index=index).dropna()
+    s2 = pd.Series(close[:, ticker_map[t2]], index=index).dropna()
+    common_idx = s1.index.intersection(s2.index)
+    try:
+        spread_series, beta = compute_spread(s1.loc[common_idx], s2.loc[common_idx])
+    except ValueError:
+        return pd.DataFrame()
+    spread = spread_series.to_numpy(dtype=float)
+    ret1 = s1.loc[spread_series.index].pct_change().fillna(0).to_numpy()
+    ret2 = s2.loc[spread_series.index].pct_change().fillna(0).to_numpy()
+
+    sums = rolling_sums(spread)
+    rows = []
+    for zscore_window in zscore_windows:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            zscore = (spread - rolling_mean(sums, zscore_window)) / rolling_std(sums, zscore_window)
+        zscore = np.where(np.isfinite(zscore), zscore, 0.0) #som replace(inf, 0).fillna(0)
+        for z_entry, z_exit in thresholds:
+            state = hysteresis_positions(zscore, z_entry, z_exit)
+            stats = _return_stats(pairs_daily_returns(state, beta, ret1, ret2))
+            stats['Trades'] = int(np.count_nonzero(np.diff(state)))
+            rows.append({'Ticker1': t1, 'Ticker2': t2, 'zscore_window': zscore_window,
+                         'z_entry': z_entry, 'z_exit': z_exit, 'beta': beta, **stats})
+    return pd.DataFrame(rows)
+
+
+def _coint_task(task) -> pd.DataFrame:
+    """
+    Engle-Granger tests for one block [lo, hi) of the upper triangle of pairs numbered like np.triu_indices,
+    or for the block's own (positions, first, second) slice of the candidates when the task carries one.
+    Returns the significant pairs, or every tested pair when significance is None.
+    """
+    lo, hi, significance, batch_size, block = task
+    tickers = _context['tickers']
+    if block is None:
+        first, second = np.triu_indices(len(tickers), k=1)
+        positions, first, second = np.arange(lo, hi), first[lo:hi], second[lo:hi]
+    else:
+        positions, first, second = block
+    pvalues = coint_pvalues(_context['close'], first, second, batch_size=batch_size)
+    found = np.arange(len(pvalues)) if significance is None else np.flatnonzero(pvalues < significance)
+    return pd.DataFrame({'pair': positions[found], 'Ticker1': tickers[first[found]],
+                         'Ticker2': tickers[second[found]], 'pvalue': pvalues[found]})
+
+
+def _results(task_fn, tasks, close, index, tickers, processes):
+    """Yields the result of every task, from a process pool attached to one shared copy of close, or in-process if processes is 1."""
+    processes = os.cpu_count() if processes is None else processes
+    processes = max(1, min(processes, len(tasks)))
+    if processes == 1:
+        saved = dict(_context)
+        _set_context(close, index, tickers)
+        try:
+            for task in tasks:
+                yield task_fn(task)
+        finally:
+            _context.clear()
+            _context.update(saved)
+        return
+    matrix = SharedMatrix.from_array(close)
+    pool = Pool(processes, initializer=_init_worker, initargs=(matrix.spec, index, list(tickers)))
+    try:
+        #resultater streames i den rækkefølge de bliver færdige
+        for result in pool.imap_unordered(task_fn, tasks, chunksize=1):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate() #stopper også workerne hvis generatoren lukkes før tid
+        pool.join()
+        matrix.close()
+
+def _run(task_fn, tasks, close, index, tickers, processes, stream):
+    """Runs the tasks with _results and concatenates the result tables, or streams them if stream is True."""
+    results = _results(task_fn, tasks, close, index, tickers, processes)
+    if stream:
+        return (frame for frame in results if not frame.empty)
+    frames = [frame for frame in results if not frame.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def _close_matrix(data, tickers, start_date, end_date):
+    close = slice_dates(get_field_frame(data, 'Close'), start_date, end_date)
+    close = close.reindex(columns=pd.Index(tickers))
+    return np.ascontiguousarray(close.to_numpy(dtype=float)), close.index
+
+
+def sweep_moving_average(data, windows, tickers=None, start_date=None, end_date=None, processes=None,
+                         block_size=None, stream=False):
+    """
+    Runs the MA-strategy of BackTester.moving_average_strat for every ticker and every window.
+    Tickers are split in blocks that are spread over a process pool, and each block computes its rolling sums
+    once and reuses them for all windows.
+
+    Args:
+        data (pd.DataFrame or PriceCube): Price data
+        windows (list of int): Moving average windows to test
+        tickers (list, optional): Tickers to test. Defaults to every ticker in data.
+        start_date, end_date (str, optional): Date range of the backtests.
+        processes (int, optional): Worker processes, defaults to the number of cores. 1 runs in this process.
+        block_size (int, optional): Tickers per task. Defaults to about four tasks per process.
+        stream (bool, optional): If True, returns an iterator of partial result tables as the tasks finish.
+
+    Returns:
+        pd.DataFrame: One row per (Ticker, window) with the columns of BackTester.moving_average_screen.
+    """
+    tickers = list(get_tickers(data)) if tickers is None else list(tickers)
+    close, index = _close_matrix(data, tickers, start_date, end_date)
+    windows = sorted(set(int(window) for window in windows))
+    n_workers = os.cpu_count() if processes is None else processes
+    if block_size is None:
+        block_size = max(1, -(-len(tickers) // (max(n_workers, 1) * 4)))
+    tasks = [(np.arange(lo, min(lo + block_size, len(tickers))), windows) for lo in range(0, len(tickers), block_size)]
+    return _run(_ma_task, tasks, close, index, tickers, processes, stream)
+
+
+def sweep_pairs_trading(data, pairs, zscore_windows=(30,), z_entries=(2.3,), z_exits=(0.5,), start_date=None,
+                        end_date=None, processes=None, stream=False):
+    """
+    Runs the pairs trading rules of BackTester.pairs_trading_strategy for every pair and every combination of
+    zscore_window, z_entry and z_exit. Each pair is one task in a process pool, so the spread and its rolling sums
+    are computed once per pair and shared by the whole grid.
+
+    Args:
+        data (pd.DataFrame or PriceCube): Price data
+        pairs (list of tuples): (ticker1, ticker2) pairs, e.g. from find_cointegrated_pairs (p-values are ignored)
+        zscore_windows, z_entries, z_exits (lists): Parameter grid
+        start_date, end_date (str, optional): Date range of the backtests.
+        processes (int, optional): Worker processes, defaults to the number of cores. 1 runs in this process.
+        stream (bool, optional): If True, returns an iterator of partial result tables as the pairs finish.
+
+    Returns:
+        pd.DataFrame: One row per pair and grid point with beta, Total Return, Annualized Return, Annualized Volatility,
+            Sharpe Ratio, Max Drawdown and Trades (number of position changes).
+    """
+    pairs = [(pair[0], pair[1]) for pair in pairs]
+    tickers = list(dict.fromkeys(ticker for pair in pairs for ticker in pair))
+    close, index = _close_matrix(data, tickers, start_date, end_date)
+    zscore_windows = sorted(set(int(window) for window in zscore_windows))
+    thresholds = list(itertools.product(z_entries, z_exits))
+    tasks = [(t1, t2, zscore_windows, thresholds) for t1, t2 in pairs]
+    return _run(_pairs_task, tasks, close, index, tickers, processes, stream)
+
+
+def _scan_blocks(tasks, close, index, tickers, processes, top_k, cancel, significance, cached=None, cache_store=None):
+    """
+    Significant pairs of every finished block, until all blocks are done, top_k pairs are found or cancel is set.
+    cached holds the significant pairs read from a cache and is yielded first. With cache_store the tasks return every
+    tested pair, they are filtered by significance here and handed to cache_store when the scan ends.
+    """
+    results = _results(_coint_task, tasks, close, index, tickers, processes)
+    tested = []
+    n_found = 0
+    try:
+        for frame in itertools.chain([] if cached is None else [cached], results):
+            if cache_store is not None and frame is not cached:
+                tested.append(frame)
+                frame = frame[frame['pvalue'] < significance]
+            block = [(pair, t1, t2, float(pvalue)) for pair, t1, t2, pvalue in frame.itertuples(index=False, name=None)]
+            n_found += len(block)
+            if block:
+                yield block
+            if (top_k is not None and n_found >= top_k) or (cancel is not None and cancel.is_set()):
+                break
+    finally:
+        results.close() #lukker poolen og den delte hukommelse med det samme
+        if cache_store is not None:
+            cache_store(tested)
+
+
+def scan_cointegrated_pairs(data, tickers=None, significance=0.05, start_date=None, end_date=None, processes=None,
+                            block_size=None, batch_size=128, top_k=None, cancel=None, stream=False, prescreen=None, metadata=None,
+                            cache=None):
+    """
+    Parallel version of pairs_trading.find_cointegrated_pairs. The upper triangle of ticker pairs is split in
+    blocks with the same number of pairs, and the blocks are tested with the batched Engle-Granger test in a process
+    pool, where every worker reads the same close matrix in shared memory.
+
+    Args:
+        data (pd.DataFrame or PriceCube): Price data
+        tickers (list, optional): Tickers to pair up. Defaults to every ticker in data.
+        significance (float, optional): Significance level for cointegration. Defaults to 0.05.
+        start_date, end_date (str, optional): Date range of the tests. Defaults to all of data, like find_cointegrated_pairs.
+        processes (int, optional): Worker processes, defaults to the number of cores. 1 runs in this process.
+        block_size (int, optional): Pairs per task. Defaults to about four tasks per process, at most 4096 pairs.
+        batch_size (int, optional): Pairs per batch inside a task, see cointegration.coint_pvalues.
+        top_k (int, optional): Stop as soon as top_k significant pairs are found and return the top_k lowest p-values
+            among them. These are the best pairs of the blocks tested so far, not necessarily of all pairs.
+        cancel (threading.Event, optional): Set it from another thread to stop the scan after the blocks that are running.
+            The pairs found until then are returned.
+        stream (bool, optional): If True, returns an iterator of lists of significant pairs as the blocks finish.
+            Closing the iterator early also stops the pool.
+        prescreen (dict, optional): Options for cointegration.prescreen_pairs. The candidates are chosen before the
+            pool starts, and only they are split in blocks.
+        metadata (pd.DataFrame, optional): Metadata table with the sectors for same_sector.
+        cache (CointegrationCache, optional): Pairs found in the cache are not sent to the pool, and their significant
+            pairs come first. The pairs tested by the pool are stored and the cache is saved when the scan ends,
+            or when a stream is closed or exhausted.
+
+    Returns:
+        list: (ticker1, ticker2, pvalue) tuples sorted by p-value, the same as find_cointegrated_pairs when the scan completes.
+    """
+    tickers = list(get_tickers(data)) if tickers is None else list(tickers)
+    check_tickers(data, tickers)
+    close, index = _close_matrix(data, tickers, start_date, end_date)
+    first = second = todo = cached = cache_store = None #todo: positioner i (first, second) der skal testes, None = alle par
+    if prescreen is not None:
+        first, second, _ = candidate_pairs(data, tickers, close, prescreen=prescreen, metadata=metadata)
+        todo = np.arange(len(first))
+    if cache is not None:
+        if first is None:
+            first, second = np.triu_indices(len(tickers), k=1)
+        pvalues, found = cache.lookup(close, index, tickers, first, second)
+        hits = np.flatnonzero(found & (pvalues < significance))
+        names = np.asarray(tickers, dtype=object)
+        cached = pd.DataFrame({'pair': hits, 'Ticker1': names[first[hits]], 'Ticker2': names[second[hits]], 'pvalue': pvalues[hits]})
+        todo = np.flatnonzero(~found)
+
+        def cache_store(frames):
+            if frames:
+                tested = pd.concat(frames, ignore_index=True)
+                pair = tested['pair'].to_numpy(dtype=np.int64)
+                cache.store(close, index, tickers, first[pair], second[pair], tested['pvalue'].to_numpy())
+            cache.save()
+
+    n_pairs = len(tickers) * (len(tickers) - 1) // 2 if todo is None else len(todo)
+    n_workers = os.cpu_count() if processes is None else processes
+    if block_size is None:
+        block_size = min(max(batch_size, -(-n_pairs // (max(n_workers, 1) * 4))), 4096)
+
+    def block(lo):
+        #hver task får kun sin egen del af kandidaterne, ikke hele listen
+        if todo is None:
+            return None
+        positions = todo[lo:lo + block_size]
+        return positions, first[positions], second[positions]
+    tasks = [(lo, min(lo + block_size, n_pairs), None if cache is not None else significance, batch_size, block(lo))
+             for lo in range(0, n_pairs, block_size)]
+    blocks = _scan_blocks(tasks, close, index, tickers, processes, top_k, cancel, significance, cached, cache_store)
+    if stream:
+        return ([(t1, t2, pvalue) for _, t1, t2, pvalue in block] for block in blocks)
+
+    #sorteret efter p-værdi, og lige p-værdier i parrenes rækkefølge uanset hvilken worker der blev færdig først
+    found = sorted((pair for block in blocks for pair in block), key=lambda pair: (pair[3], pair[0]))
+    return [(t1, t2, pvalue) for _, t1, t2, pvalue in found[:top_k]]
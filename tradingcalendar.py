@@ -0,0 +1,103 @@
+import pandas as pd
+
+
+class TradingCalendar:
+    """
+    Trading days of a price index with O(log n) date resolution.
+    Built once from the data index and shared by Portfolio and utils, so resolving a date never scans the whole index.
+    Resolved positions are cached, so repeated lookups of the same date are O(1).
+    """
+    def __init__(self, index, cache_size=4096):
+        index = pd.DatetimeIndex(index)
+        if not index.is_monotonic_increasing:
+            raise ValueError("Trading calendar index must be sorted")
+        self.index = index
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, position) -> pd.Timestamp:
+        return self.index[position]
+
+    def __contains__(self, date):
+        return self.position(date) is not None
+
+    def __repr__(self):
+        if len(self.index) == 0:
+            return "TradingCalendar(empty)"
+        return f"TradingCalendar({self.index[0].date()} to {self.index[-1].date()}, days={len(self.index)})"
+
+    @property
+    def first(self) -> pd.Timestamp:
+        return self.index[0]
+
+    @property
+    def last(self) -> pd.Timestamp:
+        return self.index[-1]
+
+    def position(self, date):
+        """Integer position of a trading day, or None if the date is not a trading day."""
+        date = pd.Timestamp(date)
+        pos = self.index.searchsorted(date, side='left')
+        if pos < len(self.index) and self.index[pos] == date:
+            return pos
+        return None
+
+    def next_position(self, date) -> int:
+        """Position of the first trading day on or after date. Raises ValueError if there is none."""
+        date = pd.Timestamp(date)
+        pos = self._cache.get(date)
+        if pos is None:
+            pos = self.index.searchsorted(date, side='left')
+            if pos == len(self.index):
+                raise ValueError(f"No valid date found after {date}.")
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[date] = pos
+        return pos
+
+    def previous_position(self, date) -> int:
+        """Position of the last trading day on or before date. Raises ValueError if there is none."""
+        pos = self.index.searchsorted(pd.Timestamp(date), side='right') - 1
+        if pos < 0:
+            raise ValueError(f"No dates before {date} in data index.")
+        return pos
+
+    def resolve(self, date) -> tuple[pd.Timestamp, int]:
+        """Returns the first trading day on or after date and its position. None resolves to the last trading day."""
+        if date is None:
+            pos = len(self.index) - 1
+        else:
+            pos = self.next_position(date)
+        return self.index[pos], pos
+
+    def next_trading_day(self, date) -> pd.Timestamp:
+        return self.index[self.next_position(date)]
+
+    def previous_trading_day(self, date) -> pd.Timestamp:
+        return self.index[self.previous_position(date)]
+
+    def positions(self, dates):
+        """Vectorized next_position for many dates. Raises ValueError if any date is after the last trading day."""
+        positions = self.index.searchsorted(pd.DatetimeIndex(dates), side='left')
+        if len(positions) and positions.max() == len(self.index):
+            raise ValueError("No valid date found after the last trading day.")
+        return positions
+
+    def slice_positions(self, start=None, end=None) -> tuple[int, int]:
+        """Half-open position range [lo, hi) of the trading days with start <= date <= end."""
+        lo = 0 if start is None else self.index.searchsorted(pd.Timestamp(start), side='left')
+        hi = len(self.index) if end is None else self.index.searchsorted(pd.Timestamp(end), side='right')
+        return lo, hi
+
+
+def get_calendar(data) -> TradingCalendar:
+    """Returns the calendar of an object that carries one (e.g. a Portfolio), or builds one from a data index."""
+    calendar = getattr(data, 'calendar', None)
+    if isinstance(calendar, TradingCalendar):
+        return calendar
+    if isinstance(data, TradingCalendar):
+        return data
+    return TradingCalendar(data.index)
@@ -0,0 +1,240 @@
+import copy
+import numpy as np
+import pandas as pd
+
+log_columns = ['Type', 'Date', 'Ticker', 'Quantity', 'Price', 'Total']
+
+
+class TransactionLog:
+    """
+    Append-only, columnar transaction log.
+    Every column is a typed numpy array that grows in chunks, Type and Ticker are stored as integer codes.
+    The DataFrame view is cached and only rebuilt after new entries are appended.
+    Rows can be looked up by ticker and by date without scanning the log.
+    fork() gives a copy-on-write clone that shares the stored columns until one of the logs is appended to.
+    """
+    def __init__(self, capacity=1024):
+        self._n = 0
+        self._types = []            #kode -> type
+        self._type_codes = {}       #type -> kode
+        self._tickers = []
+        self._ticker_codes = {}
+        self._ticker_rows = {}      #tickerkode -> liste af rækkenumre
+        self._allocate(capacity)
+        self._dates_sorted = True   #så længe der logges i datoorden kan datoopslag bruge searchsorted direkte
+        self._date_order = None
+        self._frame = None
+        self._shared = False        #kolonnerne deles med en fork og skal kopieres før der skrives
+
+    def _allocate(self, capacity):
+        self._type_col = np.empty(capacity, dtype=np.int16)
+        self._date_col = np.empty(capacity, dtype='datetime64[ns]')
+        self._ticker_col = np.empty(capacity, dtype=np.int32)
+        self._quantity_col = np.empty(capacity, dtype=np.float64)
+        self._price_col = np.empty(capacity, dtype=np.float64)
+        self._total_col = np.empty(capacity, dtype=np.float64)
+
+    def _columns(self):
+        return ['_type_col', '_date_col', '_ticker_col', '_quantity_col', '_price_col', '_total_col']
+
+    def _reserve(self, extra):
+        """Grows every column, doubling the capacity, so appends are amortized O(1)."""
+        needed = self._n + extra
+        capacity = len(self._type_col)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in self._columns():
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+
+    def _code(self, value, values: list, codes: dict) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = len(values)
+            codes[value] = code
+            values.append(value)
+        return code
+
+    def fork(self) -> 'TransactionLog':
+        """
+        Returns a copy of the log that shares the stored columns with this one.
+        Forking is O(1), each log copies the shared columns the first time it is appended to.
+        """
+        clone = copy.copy(self)
+        self._shared = clone._shared = True
+        return clone
+
+    def _own(self):
+        """Takes private copies of the columns and lookup tables if they are shared with a fork."""
+        if not self._shared:
+            return
+        for name in self._columns():
+            setattr(self, name, getattr(self, name).copy())
+        self._types = list(self._types)
+        self._type_codes = dict(self._type_codes)
+        self._tickers = list(self._tickers)
+        self._ticker_codes = dict(self._ticker_codes)
+        self._ticker_rows = {code: list(rows) for code, rows in self._ticker_rows.items()}
+        self._shared = False
+
+    def _invalidate(self):
+        self._frame = None
+        self._date_order = None
+
+    def append(self, type_: str, date, ticker, quantity, price, total) -> None:
+        """Appends one transaction."""
+        self._own()
+        self._reserve(1)
+        i = self._n
+        date = np.datetime64(pd.Timestamp(date), 'ns')
+        if i > 0 and date < self._date_col[i - 1]:
+            self._dates_sorted = False
+        ticker_code = self._code(ticker, self._tickers, self._ticker_codes)
+        self._type_col[i] = self._code(type_, self._types, self._type_codes)
+        self._date_col[i] = date
+        self._ticker_col[i] = ticker_code
+        self._quantity_col[i] = quantity
+        self._price_col[i] = price
+        self._total_col[i] = total
+        self._ticker_rows.setdefault(ticker_code, []).append(i)
+        self._n += 1
+        self._invalidate()
+
+    def extend(self, types, dates, tickers, quantities, prices, totals) -> None:
+        """Appends many transactions at once. All arguments are equally long sequences."""
+        count = len(dates)
+        if count == 0:
+            return
+        self._own()
+        self._reserve(count)
+        lo, hi = self._n, self._n + count
+        dates = pd.DatetimeIndex(dates).values.astype('datetime64[ns]')
+        if (lo > 0 and dates[0] < self._date_col[lo - 1]) or (count > 1 and (np.diff(dates) < np.timedelta64(0)).any()):
+            self._dates_sorted = False
+        ticker_codes = np.fromiter((self._code(t, self._tickers, self._ticker_codes) for t in tickers), dtype=np.int32, count=count)
+        self._type_col[lo:hi] = np.fromiter((self._code(t, self._types, self._type_codes) for t in types), dtype=np.int16, count=count)
+        self._date_col[lo:hi] = dates
+        self._ticker_col[lo:hi] = ticker_codes
+        self._quantity_col[lo:hi] = quantities
+        self._price_col[lo:hi] = prices
+        self._total_col[lo:hi] = totals
+        for row, code in enumerate(ticker_codes.tolist(), start=lo):
+            self._ticker_rows.setdefault(code, []).append(row)
+        self._n = hi
+        self._invalidate()
+
+    def __len__(self):
+        return self._n
+
+    def __bool__(self):
+        return self._n > 0
+
+    def __repr__(self):
+        return f"TransactionLog(entries={self._n}, tickers={len(self._tickers)})"
+
+    def __getitem__(self, i) -> dict:
+        """One transaction as a dict, like the entries of the old list based log."""
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError("log index out of range")
+        return {
+            'Type': self._types[self._type_col[i]],
+            'Date': pd.Timestamp(self._date_col[i]),
+            'Ticker': self._tickers[self._ticker_col[i]],
+            'Quantity': self._quantity_col[i],
+            'Price': self._price_col[i],
+            'Total': self._total_col[i],
+        }
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self[i]
+
+    def column(self, name: str) -> np.ndarray:
+        """Read-only view of a column. Type and Ticker are returned as arrays of labels."""
+        n = self._n
+        if name == 'Type':
+            return np.asarray(self._types, dtype=object)[self._type_col[:n]] if n else np.empty(0, dtype=object)
+        if name == 'Ticker':
+            return np.asarray(self._tickers, dtype=object)[self._ticker_col[:n]] if n else np.empty(0, dtype=object)
+        view = {
+            'Date': self._date_col, 'Quantity': self._quantity_col,
+            'Price': self._price_col, 'Total': self._total_col
+        }[name][:n]
+        view = view.view()
+        view.flags.writeable = False
+        return view
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The log as a DataFrame with columns Type, Date, Ticker, Quantity, Price, Total.
+        Type and Ticker are categoricals built from the stored codes, the numeric columns are views of the log arrays.
+        The frame is cached until the next append, treat it as read-only.
+        """
+        if self._frame is None:
+            n = self._n
+            self._frame = pd.DataFrame({
+                'Type': pd.Categorical.from_codes(self._type_col[:n], categories=pd.Index(self._types, dtype=object)),
+                'Date': self._date_col[:n],
+                'Ticker': pd.Categorical.from_codes(self._ticker_col[:n], categories=pd.Index(self._tickers, dtype=object)),
+                'Quantity': self._quantity_col[:n],
+                'Price': self._price_col[:n],
+                'Total': self._total_col[:n],
+            }, columns=log_columns, copy=False)
+        return self._frame
+
+    def to_arrow(self):
+        """The log as a pyarrow Table. Type and Ticker become dictionary arrays over the stored codes."""
+        import pyarrow as pa
+        n = self._n
+        return pa.table({
+            'Type': pa.DictionaryArray.from_arrays(pa.array(self._type_col[:n]), pa.array(self._types, type=pa.string())),
+            'Date': pa.array(self._date_col[:n]),
+            'Ticker': pa.DictionaryArray.from_arrays(pa.array(self._ticker_col[:n]), pa.array(self._tickers, type=pa.string())),
+            'Quantity': pa.array(self._quantity_col[:n]),
+            'Price': pa.array(self._price_col[:n]),
+            'Total': pa.array(self._total_col[:n]),
+        })
+
+    @property
+    def tickers(self) -> list:
+        """Tickers that appear in the log, in order of first appearance."""
+        return list(self._tickers)
+
+    def ticker_rows(self, ticker) -> np.ndarray:
+        """Row numbers of the transactions for a ticker, in log order."""
+        code = self._ticker_codes.get(ticker)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        return np.asarray(self._ticker_rows[code], dtype=np.int64)
+
+    def date_rows(self, start=None, end=None) -> np.ndarray:
+        """Row numbers of the transactions with start <= date <= end, in date order."""
+        n = self._n
+        dates = self._date_col[:n]
+        if self._dates_sorted:
+            order = None
+            sorted_dates = dates
+        else:
+            if self._date_order is None:
+                self._date_order = np.argsort(dates, kind='stable')
+            order = self._date_order
+            sorted_dates = dates[order]
+        lo = 0 if start is None else np.searchsorted(sorted_dates, np.datetime64(pd.Timestamp(start), 'ns'), side='left')
+        hi = n if end is None else np.searchsorted(sorted_dates, np.datetime64(pd.Timestamp(end), 'ns'), side='right')
+        if order is None:
+            return np.arange(lo, hi)
+        return order[lo:hi]
+
+    def for_ticker(self, ticker) -> pd.DataFrame:
+        """Transactions of one ticker as a DataFrame."""
+        return self.to_frame().iloc[self.ticker_rows(ticker)]
+
+    def between(self, start=None, end=None) -> pd.DataFrame:
+        """Transactions with start <= date <= end as a DataFrame, in date order."""
+        return self.to_frame().iloc[self.date_rows(start, end)]
@@ -1,6 +1,10 @@
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
+from pricecube import has_ticker, get_price, get_latest_price
+from metadata import map_sectors
+from tradingcalendar import TradingCalendar, get_calendar
+from holdings import holdings_history
 def plot_portfolio_value(self, start_date="2021-01-01", end_date=pd.Timestamp.today()):
         """
         Plots total portfolio value over time, accounting for changing holdings.
@@ -18,30 +22,9 @@ def plot_portfolio_value(self, start_date="2021-01-01", end_date=pd.Timestamp.to
         #filter data fra start til slutdato
         if start_date >= end_date:
             raise ValueError("Start date must be before end date.")
-        
-        date_range = self.data.loc[(self.data.index >= start_date) & (self.data.index <= end_date)].index
-
-        # Ny dataframe til holdings
-        holdings = pd.DataFrame(0, index=date_range, columns=self.data.columns.levels[0])
-
-        # Benyt log til at opdatere holdings
-        for tx in self.log:
-            tx_date = pd.to_datetime(tx['Date'])
-            if tx_date > end_date:
-                continue
-            if tx_date not in holdings.index:
-                continue 
-
-            ticker = tx['Ticker']
-            qty = tx['Quantity'] if tx['Type'] == 'Buy' else -tx['Quantity']
-            holdings.loc[tx_date:, ticker] += qty  #Opdatere holdings fra denne dato og fremad
-
-        #Få Closeprices for alle relevante datoer
-        close_prices = self.data.loc[date_range, pd.IndexSlice[:, 'Close']]
-        close_prices.columns = close_prices.columns.droplevel(1)
 
-    
-        portfolio_value = (holdings * close_prices).sum(axis=1) + self.current_cash
+        # Holdings, kontanter og værdi for hver dag, udregnet fra loggen i et vektoriseret gennemløb
+        portfolio_value = holdings_history(self, start_date, end_date).nav
 
     
         plt.figure(figsize=(10, 6))
@@ -58,14 +41,13 @@ def plot_portfolio(portfolio):
         return
 
     tickers = list(portfolio.assets.keys())
-    latest_prices = portfolio.data.loc[portfolio.data.index[-1]]
 
     weights = []
     labels = []
 
     for ticker in tickers:
         quantity = portfolio.assets[ticker]
-        price = latest_prices[(ticker, 'Close')]
+        price = get_latest_price(portfolio.data, ticker)
         value = quantity * price
         if value > 0 and np.isfinite(value):
             weights.append(value)
@@ -82,33 +64,33 @@ def plot_portfolio(portfolio):
     plt.show()
 
 
+def _holdings_at(portfolio, date) -> dict:
+    """Rebuilds the holdings on a date from the transaction log."""
+    log_df = portfolio.log.between(end=date)
+    trades = log_df[log_df['Type'].isin(['Buy', 'Sell'])]
+    signed = trades['Quantity'].where(trades['Type'] == 'Buy', -trades['Quantity'])
+    holdings = signed.groupby(trades['Ticker'].astype(object)).sum()
+    return {ticker: qty for ticker, qty in holdings.items() if qty != 0}
+
 def plot_portfolio_historic(portfolio, plot_date):
     plot_date = pd.to_datetime(plot_date)
 
     # Find nærmeste dato før eller på plot_date
-    valid_dates = portfolio.data.index[portfolio.data.index <= plot_date]
-    if len(valid_dates) == 0:
+    try:
+        date = get_calendar(portfolio).previous_trading_day(plot_date)
+    except ValueError:
         print(f"No data available before {plot_date}")
         return
-    date = valid_dates[-1]
 
     # Udregn portofølje på plot_date
-    holdings = {}
-    for tx in portfolio.log:
-        tx_date = pd.to_datetime(tx['Date'])
-        if tx_date <= date:
-            qty = holdings.get(tx['Ticker'], 0)
-            if tx['Type'] == 'Buy':
-                holdings[tx['Ticker']] = qty + tx['Quantity']
-            elif tx['Type'] == 'Sell':
-                holdings[tx['Ticker']] = qty - tx['Quantity']
+    holdings = _holdings_at(portfolio, date)
 
     # Udregn værdien af hver beholdning på plot_date
     values = []
     tickers = []
     for ticker, qty in holdings.items():
-        if ticker in portfolio.data.columns.levels[0]:
-            price = portfolio.data.loc[date, (ticker, 'Close')]
+        if has_ticker(portfolio.data, ticker):
+            price = get_price(portfolio.data, date, ticker)
             values.append(qty * price)
             tickers.append(ticker)
 
@@ -125,22 +107,16 @@ def plot_portfolio_historic(portfolio, plot_date):
     
 def plot_sector_distribution(portfolio):
     """
-    Plots the sector distribution of the portfolio.
+    Plots the sector distribution of the portfolio holdings, using the portfolio's metadata table.
  
     Returns:
     None
     """
-    tickers = portfolio.data.columns.levels[0]
+    if not portfolio.assets:
+        print("No holdings in the portfolio.")
+        return
     
-    sectors = []
-    for ticker in tickers:
-        if 'Sector' in portfolio.data.columns:
-            sector_val = portfolio.data[(ticker, 'Sector')].dropna().iloc[0]
-            sectors.append(sector_val)
-        else:
-            sectors.append('Unknown')
-            
-    sector_counts = pd.Series(sectors).value_counts()
+    sector_counts = map_sectors(portfolio.metadata, list(portfolio.assets.keys())).value_counts()
     
     
     plt.figure(figsize=(10, 6))
@@ -154,9 +130,10 @@ def plot_sector_distribution(portfolio):
     
 def plot_sector_distribution_historic(portfolio, plot_date):
     """
-    Plots the sector distribution of the portfolio at a specific date.
+    Plots the sector distribution of the portfolio holdings at a specific date.
     
     Parameters:
+    portfolio (Portfolio): The portfolio, holdings are rebuilt from its log.
     plot_date: The date for which to plot the sector distribution.
     
     Returns:
@@ -165,20 +142,18 @@ def plot_sector_distribution_historic(portfolio, plot_date):
     plot_date = pd.to_datetime(plot_date)
 
     #nærmeste dato før eller på plot_date
-    valid_dates = portfolio.index[portfolio.index <= plot_date]
-    if len(valid_dates) == 0:
+    try:
+        date = get_calendar(portfolio).previous_trading_day(plot_date)
+    except ValueError:
         print(f"No data available before {plot_date}")
         return
-    date = valid_dates[-1]
 
     #find sektor for hver ticker
-    sectors = []
-    for ticker in portfolio.columns.levels[0]:
-        if (ticker, 'Sector') in portfolio.columns:
-            sector_val = portfolio.loc[date, (ticker, 'Sector')]
-            sectors.append(sector_val)
-    
-    sector_counts = pd.Series(sectors).value_counts()
+    holdings = _holdings_at(portfolio, date)
+    if not holdings:
+        print(f"No holdings on {date}")
+        return
+    sector_counts = map_sectors(portfolio.metadata, list(holdings.keys())).value_counts()
     
     plt.figure(figsize=(10, 6))
     sector_counts.plot(kind='bar')
@@ -190,37 +165,35 @@ def plot_sector_distribution_historic(portfolio, plot_date):
     plt.show()
     
 def verify_date_in_df(df: pd.DataFrame, date) -> pd.Timestamp:
-    date = pd.to_datetime(date)
-    if date in df.index:
-        return date
-    next_dates = df.index[df.index > date]
-    if len(next_dates) == 0:
-        raise ValueError(f"No valid date found after {date}.")
-    return next_dates[0]
+    """Returns date if it is in the index of df, otherwise the next available date."""
+    return get_calendar(df).next_trading_day(date)
     
 def get_time_interval(
     data: pd.DataFrame,
     start_date=None,
     end_date=None,
-    verify_date=verify_date_in_df) -> tuple[pd.Timestamp, pd.Timestamp]:
-    index = data.index
+    verify_date=None,
+    calendar: TradingCalendar = None) -> tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    Resolves start_date to the next trading day and end_date to the previous trading day.
+    Pass the portfolio's calendar to avoid rebuilding it from data.
+    verify_date (callable, optional): Custom resolver verify_date(data, start_date) for the start date.
+        Defaults to the calendar, which gives the same result as verify_date_in_df.
+    """
+    calendar = calendar if calendar is not None else get_calendar(data)
     
     if start_date is not None:
-        start = verify_date(data, start_date)
+        if verify_date is None:
+            start = calendar.next_trading_day(start_date)
+        else:
+            start = verify_date(data, start_date)
     else:
-        start = index[0]
+        start = calendar.first
         
     if end_date is not None:
-        end_date = pd.to_datetime(end_date)
-        if end_date in index:
-            end = end_date
-        else:
-            prev_dates = index[index < end_date]
-            if len(prev_dates) == 0:
-                raise ValueError(f"No dates before {end_date} in data index.")
-            end = prev_dates[-1]
+        end = calendar.previous_trading_day(end_date)
     else:
-        end = index[-1]
+        end = calendar.last
     
     if end < start:
         raise ValueError(f"End date {end} is before start date {start}.")